@@ -0,0 +1,429 @@
+"""
+Offline benchmarks for telegram_keyboard
+No bot token or network access needed
+
+Run:
+    python benchmarks.py                       # suite, human-readable
+    python benchmarks.py --json results.json   # also save results
+    python benchmarks.py --compare old.json    # ratio vs a saved run
+    python benchmarks.py --report backends     # JSON backend comparison
+    python benchmarks.py --report bodies       # form vs JSON bodies
+"""
+
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import telegram_keyboard
+from telegram_keyboard import (
+    TelegramKeyboard, create_button_grid, create_emoji_keyboard,
+    serialize_markup
+)
+
+
+kb = TelegramKeyboard("BENCHMARK_TOKEN")
+
+EMOJIS = [
+    "😀", "😂", "🥰", "😎", "🤔", "😴", "🤯", "🥳", "😇", "🤖",
+    "🔥", "⭐", "❤️", "👍", "👎", "✅", "❌", "⚙️", "📦", "🛒"
+]
+
+
+# ==================== HELPERS ====================
+
+def timed(func, number=1000, repeat=5):
+    """
+    Best-of-`repeat` time of one call
+    
+    Args:
+        func (callable): Function to time (no arguments)
+        number (int): Calls per measurement
+        repeat (int): Measurements taken
+    
+    Returns:
+        float: Microseconds per call
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / number * 1e6
+
+
+def emoji_reply_keyboard():
+    """Reply keyboard of 20 emoji buttons"""
+    return kb.create_reply_keyboard(create_emoji_keyboard(EMOJIS, columns=5))
+
+
+def emoji_inline_keyboard(rows=25, columns=4):
+    """Large inline catalog keyboard with emoji and non-Latin text"""
+    return kb.create_inline_keyboard([
+        [
+            kb.create_callback_button(
+                f"{EMOJIS[(r * columns + c) % len(EMOJIS)]} Товар №{r * columns + c}",
+                f"item_{r * columns + c}"
+            )
+            for c in range(columns)
+        ]
+        for r in range(rows)
+    ])
+
+
+def allocations(func, calls=100):
+    """
+    Memory allocated per call, results kept alive
+    
+    Args:
+        func (callable): Function to measure (no arguments)
+        calls (int): Calls averaged over
+    
+    Returns:
+        tuple: (blocks per call, bytes per call, peak bytes per call)
+    """
+    func()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        start, _ = tracemalloc.get_traced_memory()
+        can_reset_peak = hasattr(tracemalloc, "reset_peak")  # Python 3.9+
+        if can_reset_peak:
+            tracemalloc.reset_peak()
+        
+        results = [func() for _ in range(calls)]
+        
+        end, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    del results
+    peak_bytes = peak - start if can_reset_peak else _peak_bytes(func, calls)
+    return blocks / calls, (end - start) / calls, peak_bytes / calls
+
+
+def _peak_bytes(func, calls):
+    """Peak traced bytes of `calls` calls, in a fresh tracing session"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        results = [func() for _ in range(calls)]
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del results
+    return peak - start
+
+
+# ==================== SUITE ====================
+
+# name -> (shape, setup); setup() returns the function to time
+BENCHMARKS = {}
+
+
+def benchmark(name, shape):
+    """Register a benchmark setup under name"""
+    def register(setup):
+        BENCHMARKS[name] = (shape, setup)
+        return setup
+    return register
+
+
+GRID_ITEMS = [f"Product {i}" for i in range(100)]
+
+
+@benchmark("button/callback", "single")
+def _():
+    return lambda: kb.create_callback_button("✅ Confirm", "confirm")
+
+
+@benchmark("button/url", "single")
+def _():
+    return lambda: kb.create_url_button("🌐 Website", "https://example.com")
+
+
+@benchmark("build/small_menu", "small_menu")
+def _():
+    return lambda: kb.create_inline_keyboard([
+        [kb.create_callback_button("📦 Orders", "orders"),
+         kb.create_callback_button("🛒 Cart", "cart")],
+        [kb.create_callback_button("⚙️ Settings", "settings"),
+         kb.create_callback_button("❓ Help", "help")]
+    ])
+
+
+@benchmark("build/grid_100", "grid_100")
+def _():
+    return lambda: kb.create_inline_keyboard(create_button_grid(GRID_ITEMS, columns=4))
+
+
+@benchmark("build/create_button_grid_100", "grid_100")
+def _():
+    return lambda: create_button_grid(GRID_ITEMS, columns=4)
+
+
+@benchmark("build/emoji_pad", "emoji_pad")
+def _():
+    return emoji_reply_keyboard
+
+
+@benchmark("build/create_emoji_keyboard", "emoji_pad")
+def _():
+    return lambda: create_emoji_keyboard(EMOJIS, columns=5)
+
+
+@benchmark("preset/main_menu", "small_menu")
+def _():
+    return lambda: kb.create_reply_keyboard(kb.main_menu())
+
+
+@benchmark("preset/main_menu_cached", "small_menu")
+def _():
+    return lambda: kb.preset_keyboard("main_menu")
+
+
+@benchmark("preset/number_keyboard", "number_pad")
+def _():
+    return lambda: kb.create_reply_keyboard(kb.number_keyboard())
+
+
+@benchmark("preset/number_keyboard_cached", "number_pad")
+def _():
+    return lambda: kb.preset_keyboard("number_keyboard")
+
+
+@benchmark("preset/pagination_keyboard", "pagination")
+def _():
+    return lambda: kb.create_inline_keyboard(kb.pagination_keyboard(5, 20))
+
+
+@benchmark("preset/pagination_keyboard_cached", "pagination")
+def _():
+    return lambda: kb.preset_keyboard("pagination_keyboard", 5, 20)
+
+
+@benchmark("serialize/small_menu", "small_menu")
+def _():
+    markup = BENCHMARKS["build/small_menu"][1]()()
+    return lambda: serialize_markup(markup)
+
+
+@benchmark("serialize/grid_100", "grid_100")
+def _():
+    markup = kb.create_inline_keyboard(create_button_grid(GRID_ITEMS, columns=4))
+    return lambda: serialize_markup(markup)
+
+
+@benchmark("serialize/emoji_pad", "emoji_pad")
+def _():
+    markup = emoji_reply_keyboard()
+    return lambda: serialize_markup(markup)
+
+
+@benchmark("serialize/emoji_inline_100", "emoji_inline_100")
+def _():
+    markup = emoji_inline_keyboard()
+    return lambda: serialize_markup(markup)
+
+
+@benchmark("serialize/frozen_grid_100", "grid_100")
+def _():
+    frozen = kb.freeze(kb.create_inline_keyboard(create_button_grid(GRID_ITEMS, columns=4)))
+    return lambda: serialize_markup(frozen)
+
+
+@benchmark("request/send_message_grid_100", "grid_100")
+def _():
+    markup = kb.create_inline_keyboard(create_button_grid(GRID_ITEMS, columns=4))
+    return lambda: kb._encode_body(kb._message_payload(123456789, "Catalog", markup))
+
+
+def run_suite(pattern=None, number=None):
+    """
+    Run registered benchmarks
+    
+    Args:
+        pattern (str): Only run benchmarks whose name contains this
+        number (int): Calls per measurement (default: auto, ~20 ms)
+    
+    Returns:
+        list: One result dict per benchmark
+    """
+    results = []
+    for name, (shape, setup) in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        
+        func = setup()
+        calls = number or _calibrate(func)
+        us_per_op = timed(func, number=calls)
+        blocks, alloc_bytes, peak_bytes = allocations(func)
+        
+        results.append({
+            "name": name,
+            "shape": shape,
+            "ops_per_sec": round(1e6 / us_per_op, 1),
+            "us_per_op": round(us_per_op, 3),
+            "alloc_blocks": round(blocks, 1),
+            "alloc_bytes": round(alloc_bytes),
+            "peak_bytes": round(peak_bytes)
+        })
+        print(f"{name:36} {shape:17} {1e6 / us_per_op:12,.0f} ops/s "
+              f"{us_per_op:9.2f} us  {blocks:7.1f} blocks  {alloc_bytes:9,.0f} B")
+    return results
+
+
+def _calibrate(func, target=0.02):
+    """Calls needed for one measurement to take about target seconds"""
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        if time.perf_counter() - start >= target / 10 or calls >= 1000000:
+            elapsed = (time.perf_counter() - start) / calls
+            return max(1, int(target / elapsed))
+        calls *= 10
+
+
+def environment():
+    """Metadata stored with saved results"""
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "json_backend": telegram_keyboard.get_json_backend(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    }
+
+
+def compare(results, baseline_path):
+    """
+    Print speed and allocation ratios against a saved run
+    
+    Args:
+        results (list): Results of this run
+        baseline_path (str): JSON file written by --json
+    """
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    
+    print(f"\n{'benchmark':36} {'speed':>8} {'allocs':>8}")
+    for r in results:
+        old = baseline.get(r["name"])
+        if old is None:
+            print(f"{r['name']:36} {'new':>8}")
+            continue
+        speed = r["ops_per_sec"] / old["ops_per_sec"]
+        allocs = (r["alloc_bytes"] / old["alloc_bytes"]) if old["alloc_bytes"] else 1.0
+        print(f"{r['name']:36} {speed:7.2f}x {allocs:7.2f}x")
+
+
+# ==================== JSON BACKENDS ====================
+
+def bench_json_backends():
+    """Encode/decode time of emoji-heavy markup per installed backend"""
+    keyboards = {
+        "emoji_reply": emoji_reply_keyboard(),
+        "emoji_inline_100": emoji_inline_keyboard()
+    }
+    active = telegram_keyboard.get_json_backend()
+    results = []
+    
+    for backend in ("json", "ujson", "orjson"):
+        try:
+            telegram_keyboard.set_json_backend(backend)
+        except ValueError:
+            print(f"{backend:8} not installed")
+            continue
+        
+        for name, keyboard in keyboards.items():
+            encoded = telegram_keyboard.serialize_markup(keyboard)
+            raw = encoded.encode("utf-8")
+            results.append({
+                "backend": backend,
+                "keyboard": name,
+                "bytes": len(raw),
+                "dumps_us": timed(lambda: telegram_keyboard.serialize_markup(keyboard)),
+                "loads_us": timed(lambda: telegram_keyboard._json_loads(raw))
+            })
+    
+    telegram_keyboard.set_json_backend(active)
+    
+    baseline = {r["keyboard"]: r for r in results if r["backend"] == "json"}
+    for r in results:
+        base = baseline[r["keyboard"]]
+        print(f"{r['backend']:8} {r['keyboard']:18} "
+              f"dumps {r['dumps_us']:8.2f} us ({base['dumps_us'] / r['dumps_us']:4.1f}x)  "
+              f"loads {r['loads_us']:8.2f} us ({base['loads_us'] / r['loads_us']:4.1f}x)")
+    return results
+
+
+# ==================== REQUEST BODIES ====================
+
+def bench_request_bodies():
+    """Wire size and encode time of sendMessage: form vs JSON body"""
+    form_kb = TelegramKeyboard("BENCHMARK_TOKEN", json_body=False)
+    results = []
+    
+    for name, keyboard in (("emoji_reply", emoji_reply_keyboard()),
+                           ("emoji_inline_100", emoji_inline_keyboard())):
+        def payload():
+            return kb._message_payload(123456789, "Choose a product 🛒", keyboard)
+        
+        for encoding, client in (("form", form_kb), ("json", kb)):
+            body, _ = client._encode_body(payload())
+            results.append({
+                "keyboard": name,
+                "encoding": encoding,
+                "bytes": len(body),
+                "encode_us": timed(lambda: client._encode_body(payload()))
+            })
+    
+    for r in results:
+        print(f"{r['encoding']:5} {r['keyboard']:18} "
+              f"{r['bytes']:7} bytes  encode {r['encode_us']:8.2f} us")
+    return results
+
+
+# ==================== USAGE ====================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="telegram_keyboard benchmarks")
+    parser.add_argument("--filter", help="only run benchmarks containing this")
+    parser.add_argument("--number", type=int, help="calls per measurement")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="compare with results saved by --json")
+    parser.add_argument("--json-backend", help="orjson, ujson or json")
+    parser.add_argument("--report", choices=["backends", "bodies"],
+                        help="run a comparison report instead of the suite")
+    args = parser.parse_args(argv)
+    
+    if args.json_backend:
+        telegram_keyboard.set_json_backend(args.json_backend)
+    
+    if args.report == "backends":
+        return bench_json_backends()
+    if args.report == "bodies":
+        return bench_request_bodies()
+    
+    results = run_suite(args.filter, args.number)
+    
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
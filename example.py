@@ -3,7 +3,11 @@ Telegram Keyboard Library - Usage Examples
 Complete examples for all button types
 """
 
-from telegram_keyboard import TelegramKeyboard, create_button_grid, create_emoji_keyboard
+from telegram_keyboard import (
+    TelegramKeyboard, BackgroundSender, CallbackAnswerer, EditScheduler,
+    KeyboardTemplate, Poller, Router, ShardedDispatcher, create_button_grid,
+    create_emoji_keyboard
+)
 import time
 
 
@@ -11,6 +15,9 @@ import time
 BOT_TOKEN = "YOUR_BOT_TOKEN_HERE"
 kb = TelegramKeyboard(BOT_TOKEN)
 
+# Fire-and-forget sends for replies nobody reads
+sender = BackgroundSender(kb)
+
 
 # ==================== EXAMPLE 1: BASIC REPLY KEYBOARD ====================
 
@@ -267,7 +274,7 @@ def example_emoji_keyboard(chat_id):
 def example_remove_keyboard(chat_id):
     """Remove/hide keyboard"""
     
-    kb.send_remove_keyboard(chat_id, "Keyboard removed!")
+    sender.send_remove_keyboard(chat_id, "Keyboard removed!")
 
 
 # ==================== EXAMPLE 16: CATEGORIES WITH SUBCATEGORIES ====================
@@ -320,21 +327,28 @@ def show_subcategory(chat_id, category):
 
 # ==================== EXAMPLE 17: SETTINGS MENU ====================
 
-def example_settings_menu(chat_id):
+# Compiled once; each user's menu is rendered by substitution
+SETTINGS_TEMPLATE = KeyboardTemplate(kb.create_inline_keyboard([
+    [kb.create_callback_button("🔔 Notifications: {notif}", "toggle_notif")],
+    [kb.create_callback_button("🌙 Dark Mode: {dark}", "toggle_dark")],
+    [kb.create_callback_button("🔊 Sound: {sound}", "toggle_sound")],
+    [kb.create_callback_button("🌐 Language: {lang}", "change_lang")],
+    [kb.create_callback_button("🔙 Back to Menu", "main_menu")]
+]))
+
+
+def example_settings_menu(chat_id, notif="ON", dark="OFF", sound="ON",
+                          lang="English"):
     """Settings menu with toggles"""
     
-    buttons = [
-        [kb.create_callback_button("🔔 Notifications: ON", "toggle_notif")],
-        [kb.create_callback_button("🌙 Dark Mode: OFF", "toggle_dark")],
-        [kb.create_callback_button("🔊 Sound: ON", "toggle_sound")],
-        [kb.create_callback_button("🌐 Language: English", "change_lang")],
-        [kb.create_callback_button("🔙 Back to Menu", "main_menu")]
-    ]
+    keyboard = SETTINGS_TEMPLATE.render(
+        notif=notif, dark=dark, sound=sound, lang=lang
+    )
     
-    kb.send_with_inline_keyboard(
+    kb.send_message(
         chat_id,
         "⚙️ Settings",
-        buttons
+        keyboard
     )
 
 
@@ -364,21 +378,26 @@ def example_rating(chat_id):
 
 # ==================== EXAMPLE 19: DYNAMIC KEYBOARD UPDATE ====================
 
+COUNTER_TEMPLATE = KeyboardTemplate(kb.create_inline_keyboard([
+    [
+        kb.create_callback_button("➖", "decrease"),
+        kb.create_callback_button("Count: {count}", "count"),
+        kb.create_callback_button("➕", "increase")
+    ],
+    [kb.create_callback_button("🔄 Reset", "reset")]
+]))
+
+
+# Rapid ➕/➖ taps collapse into one edit of the latest count
+edits = EditScheduler(kb, window=0.3)
+
+
 def example_dynamic_update(chat_id, message_id, count=0):
     """Update inline keyboard dynamically"""
     
-    buttons = [
-        [
-            kb.create_callback_button("➖", "decrease"),
-            kb.create_callback_button(f"Count: {count}", "count"),
-            kb.create_callback_button("➕", "increase")
-        ],
-        [kb.create_callback_button("🔄 Reset", "reset")]
-    ]
-    
-    keyboard = kb.create_inline_keyboard(buttons)
+    keyboard = COUNTER_TEMPLATE.render(count=count)
     
-    kb.edit_message_text(
+    edits.submit(
         chat_id,
         message_id,
         f"Current count: {count}",
@@ -388,100 +407,70 @@ def example_dynamic_update(chat_id, message_id, count=0):
 
 # ==================== EXAMPLE 20: FULL BOT WITH ALL FEATURES ====================
 
+def build_router():
+    """Routes for the full bot example"""
+    
+    router = Router()
+    
+    # Text commands and reply keyboard buttons
+    router.add_command("start", lambda message, args: example_main_menu(message["chat"]["id"]))
+    router.add_text("📝 Register", lambda message: example_contact_location(message["chat"]["id"]))
+    router.add_text("🔐 Login", lambda message: example_yes_no(message["chat"]["id"]))
+    router.add_text("ℹ️ Help", lambda message: example_url_buttons(message["chat"]["id"]))
+    router.add_command("inline", lambda message, args: example_inline_callback(message["chat"]["id"]))
+    router.add_command("numbers", lambda message, args: example_number_keyboard(message["chat"]["id"]))
+    router.add_command("emojis", lambda message, args: example_emoji_keyboard(message["chat"]["id"]))
+    router.add_command("pagination", lambda message, args: example_pagination(message["chat"]["id"]))
+    router.add_command("categories", lambda message, args: example_categories(message["chat"]["id"]))
+    router.add_command("settings", lambda message, args: example_settings_menu(message["chat"]["id"]))
+    router.add_command("rating", lambda message, args: example_rating(message["chat"]["id"]))
+    router.add_command("remove", lambda message, args: example_remove_keyboard(message["chat"]["id"]))
+    
+    # Callback queries (inline button clicks); prefix args parsed once
+    @router.callback_prefix("page_", parse=int)
+    def on_page(callback, page):
+        example_pagination(callback["message"]["chat"]["id"], page, 5)
+    
+    @router.callback_prefix("rate_")
+    def on_rate(callback, rating):
+        sender.send_message(callback["message"]["chat"]["id"], f"Thanks for {rating}⭐ rating!")
+    
+    @router.callback_prefix("cat_")
+    def on_category(callback, category):
+        show_subcategory(callback["message"]["chat"]["id"], category)
+    
+    return router
+
+
 def full_bot_example():
     """Complete bot with all keyboard types"""
     
-    def get_updates(offset=None):
-        import requests
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/getUpdates"
-        params = {"offset": offset, "timeout": 30}
-        response = requests.get(url, params=params)
-        return response.json()
+    router = build_router()
+    
+    # Callback answers are sent in the background; clicks left
+    # unanswered for 1s get an automatic answer
+    answers = CallbackAnswerer(kb, deadline=1.0)
+    
+    def handle(update):
+        # Answer callback (inline button click) without waiting for it
+        if "callback_query" in update:
+            callback = update["callback_query"]
+            answers.answer(
+                callback["id"],
+                f"You clicked: {callback['data']}"
+            )
+        
+        router.dispatch(update)
     
     print("🤖 Bot started with all keyboard types...")
-    offset = None
-    
-    while True:
-        try:
-            updates = get_updates(offset)
-            
-            if updates.get("result"):
-                for update in updates["result"]:
-                    offset = update["update_id"] + 1
-                    
-                    # Handle messages
-                    if "message" in update:
-                        chat_id = update["message"]["chat"]["id"]
-                        text = update["message"].get("text", "")
-                        
-                        if text == "/start":
-                            example_main_menu(chat_id)
-                        
-                        elif text == "📝 Register":
-                            example_contact_location(chat_id)
-                        
-                        elif text == "🔐 Login":
-                            example_yes_no(chat_id)
-                        
-                        elif text == "ℹ️ Help":
-                            example_url_buttons(chat_id)
-                        
-                        elif text == "/inline":
-                            example_inline_callback(chat_id)
-                        
-                        elif text == "/numbers":
-                            example_number_keyboard(chat_id)
-                        
-                        elif text == "/emojis":
-                            example_emoji_keyboard(chat_id)
-                        
-                        elif text == "/pagination":
-                            example_pagination(chat_id)
-                        
-                        elif text == "/categories":
-                            example_categories(chat_id)
-                        
-                        elif text == "/settings":
-                            example_settings_menu(chat_id)
-                        
-                        elif text == "/rating":
-                            example_rating(chat_id)
-                        
-                        elif text == "/remove":
-                            example_remove_keyboard(chat_id)
-                    
-                    # Handle callback queries (inline button clicks)
-                    elif "callback_query" in update:
-                        callback = update["callback_query"]
-                        chat_id = callback["message"]["chat"]["id"]
-                        message_id = callback["message"]["message_id"]
-                        callback_data = callback["data"]
-                        callback_id = callback["id"]
-                        
-                        # Answer callback
-                        kb.answer_callback_query(
-                            callback_id,
-                            f"You clicked: {callback_data}"
-                        )
-                        
-                        # Handle different callbacks
-                        if callback_data.startswith("page_"):
-                            page = int(callback_data.split("_")[1])
-                            example_pagination(chat_id, page, 5)
-                        
-                        elif callback_data.startswith("rate_"):
-                            rating = callback_data.split("_")[1]
-                            kb.send_message(chat_id, f"Thanks for {rating}⭐ rating!")
-                        
-                        elif callback_data.startswith("cat_"):
-                            category = callback_data.split("_")[1]
-                            show_subcategory(chat_id, category)
-            
-            time.sleep(0.5)
-            
-        except Exception as e:
-            print(f"Error: {e}")
-            time.sleep(3)
+    
+    # Handlers run on 8 worker threads; updates from one chat stay in order
+    dispatcher = ShardedDispatcher(handle, workers=8)
+    
+    # Long polling with the next request already in flight while
+    # updates are handled; backs off only on errors
+    poller = Poller(kb, allowed_updates=["message", "callback_query"])
+    poller.run(answers.wrap(dispatcher.submit))
 
 
 # ==================== QUICK TEST FUNCTION ====================
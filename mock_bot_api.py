@@ -0,0 +1,790 @@
+"""
+Mock Telegram Bot API server and load-test harness
+Runs TelegramKeyboard bots against a local stand-in for api.telegram.org
+
+Run: python mock_bot_api.py --users 100 --duration 10
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from telegram_keyboard import (
+    Poller, RateController, Router, ShardedDispatcher, TelegramKeyboard
+)
+
+
+# ==================== MOCK SERVER ====================
+
+class _MockHandler(BaseHTTPRequestHandler):
+    """Serves /bot<token>/<method> requests for MockBotAPI"""
+    
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    
+    def log_message(self, format, *args):
+        pass
+    
+    
+    def _params(self):
+        """Request parameters from a JSON, form or query-string body"""
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        
+        if "json" in self.headers.get("Content-Type", ""):
+            return json.loads(body) if body else {}
+        
+        params = dict(parse_qsl(body.decode("utf-8")))
+        if "?" in self.path:
+            params.update(parse_qsl(self.path.split("?", 1)[1]))
+        for key in ("reply_markup", "allowed_updates"):
+            if key in params:
+                params[key] = json.loads(params[key])
+        return params
+    
+    
+    def _reply(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    
+    def do_POST(self):
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            return self._reply(404, _error(404, "Not Found"))
+        
+        try:
+            params = self._params()
+        except ValueError:
+            return self._reply(400, _error(400, "Bad Request: can't parse request body"))
+        
+        status, payload = self.server.api.handle(parts[1], params)
+        self._reply(status, payload)
+    
+    
+    do_GET = do_POST
+
+
+class _MockServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer with a listen backlog sized for load tests"""
+    
+    # Read by server_activate() in __init__, so it must be set on the
+    # class; the default of 5 stalls connection bursts on SYN retries
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def _error(code, description, **parameters):
+    """Bot API error response"""
+    payload = {"ok": False, "error_code": code, "description": description}
+    if parameters:
+        payload["parameters"] = parameters
+    return payload
+
+
+def _chat_id(value):
+    """Form bodies carry ids as strings"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class MockBotAPI:
+    """
+    Local stand-in for the Telegram Bot API
+    
+    Implements sendMessage, editMessageText, editMessageReplyMarkup,
+    answerCallbackQuery and getUpdates (long polling) with Telegram's
+    error responses, plus configurable latency, random error injection
+    and 429 flood control. Updates are injected with push_message() and
+    push_callback().
+    
+    Example:
+        with MockBotAPI(latency=0.05, flood_rate=30) as api:
+            kb = api.client()
+            api.push_message(42, "/start")
+            kb.get_updates(timeout=1)
+    """
+    
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_code=500, flood_rate=None,
+                 flood_retry_after=1, callback_expiry=15.0, on_request=None):
+        """
+        Args:
+            host (str): Interface to listen on
+            port (int): Port to listen on (0 picks a free port)
+            latency (float): Seconds added to every response
+            jitter (float): Extra random latency, up to this many seconds
+            error_rate (float): Fraction of requests answered with an
+                injected error (getUpdates excluded)
+            error_code (int): HTTP status / error_code of injected errors
+            flood_rate (float): Max sends per second before 429s (None:
+                unlimited)
+            flood_retry_after (int): retry_after of 429 responses
+            callback_expiry (float): Seconds a callback query can be
+                answered
+            on_request (callable): on_request(method, params, payload),
+                called as each response is sent
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.flood_rate = flood_rate
+        self.flood_retry_after = flood_retry_after
+        self.callback_expiry = callback_expiry
+        self.on_request = on_request
+        
+        self.calls = {}
+        self.errors = {}
+        self.injected_errors = 0
+        self.floods = 0
+        
+        self._lock = threading.Lock()
+        self._updates_cond = threading.Condition(self._lock)
+        self._updates = []
+        self._next_update_id = 1
+        self._messages = {}
+        self._next_message_id = {}
+        self._callbacks = {}
+        self._next_callback_id = 1
+        self._window_start = 0.0
+        self._window_sends = 0
+        self._flood_until = 0.0
+        
+        self._server = None
+        self._thread = None
+    
+    
+    # ==================== LIFECYCLE ====================
+    
+    def start(self):
+        """
+        Start serving in a background thread
+        
+        Returns:
+            MockBotAPI: self
+        """
+        server = _MockServer((self.host, self.port), _MockHandler)
+        server.api = self
+        self._server = server
+        self._thread = threading.Thread(
+            target=server.serve_forever, name="mock-bot-api", daemon=True
+        )
+        self._thread.start()
+        return self
+    
+    
+    def stop(self):
+        """Stop serving"""
+        if self._server is not None:
+            with self._updates_cond:
+                self._updates_cond.notify_all()
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+    
+    
+    def __enter__(self):
+        return self.start()
+    
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+    
+    
+    @property
+    def address(self):
+        """(host, port) actually bound, once started"""
+        return self._server.server_address if self._server else None
+    
+    
+    def api_url(self, token="TEST_TOKEN"):
+        """
+        Args:
+            token (str): Bot token
+        
+        Returns:
+            str: base_url for a client of this server
+        """
+        host, port = self.address[:2]
+        return f"http://{host}:{port}/bot{token}"
+    
+    
+    def client(self, token="TEST_TOKEN", cls=TelegramKeyboard, **kwargs):
+        """
+        Client pointed at this server
+        
+        Args:
+            token (str): Bot token
+            cls (type): TelegramKeyboard or AsyncTelegramKeyboard
+            **kwargs: Client constructor arguments
+        
+        Returns:
+            TelegramKeyboard: Client instance
+        """
+        kb = cls(token, **kwargs)
+        kb.base_url = self.api_url(token)
+        return kb
+    
+    
+    # ==================== UPDATE INJECTION ====================
+    
+    def _push_update(self, key, value):
+        with self._updates_cond:
+            update = {"update_id": self._next_update_id, key: value}
+            self._next_update_id += 1
+            self._updates.append(update)
+            self._updates_cond.notify_all()
+        return update
+    
+    
+    def push_message(self, chat_id, text):
+        """
+        Queue a user's text message for getUpdates
+        
+        Args:
+            chat_id (int): Private chat (= user) id
+            text (str): Message text
+        
+        Returns:
+            dict: The update
+        """
+        user = {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"}
+        return self._push_update("message", {
+            "message_id": self._new_message_id(chat_id),
+            "from": user,
+            "chat": {"id": chat_id, "type": "private"},
+            "date": int(time.time()),
+            "text": text
+        })
+    
+    
+    def push_callback(self, chat_id, message_id, data):
+        """
+        Queue an inline button click for getUpdates
+        
+        Args:
+            chat_id (int): Chat of the message with the keyboard
+            message_id (int): Message with the keyboard
+            data (str): callback_data of the clicked button
+        
+        Returns:
+            dict: The update
+        """
+        with self._lock:
+            query_id = str(self._next_callback_id)
+            self._next_callback_id += 1
+            self._callbacks[query_id] = [time.monotonic(), False]
+            text = self._messages.get((chat_id, message_id), ("", None))[0]
+        
+        return self._push_update("callback_query", {
+            "id": query_id,
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"},
+            "message": {
+                "message_id": message_id,
+                "chat": {"id": chat_id, "type": "private"},
+                "date": int(time.time()),
+                "text": text
+            },
+            "chat_instance": str(chat_id),
+            "data": data
+        })
+    
+    
+    # ==================== API METHODS ====================
+    
+    def handle(self, method, params):
+        """
+        Answer one API call
+        
+        Args:
+            method (str): Bot API method name
+            params (dict): Decoded parameters
+        
+        Returns:
+            tuple: (HTTP status, response payload)
+        """
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            status, payload = 404, _error(404, "Not Found")
+        elif method == "getUpdates":
+            status, payload = handler(params)
+        else:
+            status, payload = self._inject(method) or handler(params)
+            delay = self.latency + random.uniform(0, self.jitter)
+            if delay > 0:
+                time.sleep(delay)
+        
+        if not payload["ok"]:
+            with self._lock:
+                self.errors[payload["error_code"]] = self.errors.get(payload["error_code"], 0) + 1
+        if self.on_request is not None:
+            self.on_request(method, params, payload)
+        return status, payload
+    
+    
+    def _inject(self, method):
+        """Injected error or 429, if this call gets one"""
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.injected_errors += 1
+            return self.error_code, _error(self.error_code, "Internal Server Error: injected")
+        
+        if self.flood_rate is None or method not in ("sendMessage", "editMessageText",
+                                                     "editMessageReplyMarkup"):
+            return None
+        
+        with self._lock:
+            now = time.monotonic()
+            if now < self._flood_until:
+                flooded = True
+            else:
+                if now - self._window_start >= 1.0:
+                    self._window_start = now
+                    self._window_sends = 0
+                self._window_sends += 1
+                flooded = self._window_sends > self.flood_rate
+                if flooded:
+                    self._flood_until = now + self.flood_retry_after
+            if flooded:
+                self.floods += 1
+        
+        if flooded:
+            return 429, _error(
+                429, f"Too Many Requests: retry after {self.flood_retry_after}",
+                retry_after=self.flood_retry_after
+            )
+        return None
+    
+    
+    def _new_message_id(self, chat_id):
+        with self._lock:
+            message_id = self._next_message_id.get(chat_id, 0) + 1
+            self._next_message_id[chat_id] = message_id
+        return message_id
+    
+    
+    def _message(self, chat_id, message_id, text, markup):
+        message = {
+            "message_id": message_id,
+            "from": {"id": 1, "is_bot": True, "first_name": "Mock Bot"},
+            "chat": {"id": chat_id, "type": "private"},
+            "date": int(time.time()),
+            "text": text
+        }
+        if markup and "inline_keyboard" in markup:
+            message["reply_markup"] = markup
+        return message
+    
+    
+    def _api_sendMessage(self, params):
+        if "chat_id" not in params:
+            return 400, _error(400, "Bad Request: chat_id is empty")
+        if not params.get("text"):
+            return 400, _error(400, "Bad Request: message text is empty")
+        
+        chat_id = _chat_id(params["chat_id"])
+        message_id = self._new_message_id(chat_id)
+        markup = params.get("reply_markup")
+        with self._lock:
+            self._messages[(chat_id, message_id)] = (params["text"], markup)
+        return 200, {"ok": True, "result": self._message(chat_id, message_id,
+                                                         params["text"], markup)}
+    
+    
+    def _edit(self, params, text_required):
+        if "inline_message_id" in params:
+            return 200, {"ok": True, "result": True}
+        if text_required and not params.get("text"):
+            return 400, _error(400, "Bad Request: message text is empty")
+        
+        key = (_chat_id(params.get("chat_id")), _chat_id(params.get("message_id")))
+        markup = params.get("reply_markup")
+        with self._lock:
+            current = self._messages.get(key)
+            if current is None:
+                return 400, _error(400, "Bad Request: message to edit not found")
+            text = params["text"] if text_required else current[0]
+            if (text, markup) == current:
+                return 400, _error(
+                    400, "Bad Request: message is not modified: specified new "
+                         "message content and reply markup are exactly the same "
+                         "as a current content and reply markup of the message"
+                )
+            self._messages[key] = (text, markup)
+        return 200, {"ok": True, "result": self._message(key[0], key[1], text, markup)}
+    
+    
+    def _api_editMessageText(self, params):
+        return self._edit(params, text_required=True)
+    
+    
+    def _api_editMessageReplyMarkup(self, params):
+        return self._edit(params, text_required=False)
+    
+    
+    def _api_answerCallbackQuery(self, params):
+        with self._lock:
+            query = self._callbacks.get(str(params.get("callback_query_id")))
+            valid = (query is not None and not query[1]
+                     and time.monotonic() - query[0] <= self.callback_expiry)
+            if valid:
+                query[1] = True
+        if not valid:
+            return 400, _error(400, "Bad Request: query is too old and response "
+                                    "timeout expired or query ID is invalid")
+        return 200, {"ok": True, "result": True}
+    
+    
+    def _api_getUpdates(self, params):
+        offset = int(params.get("offset", 0) or 0)
+        limit = int(params.get("limit", 100) or 100)
+        timeout = float(params.get("timeout", 0) or 0)
+        deadline = time.monotonic() + timeout
+        
+        with self._updates_cond:
+            # Like Telegram: an offset confirms every earlier update
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and self._server is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_cond.wait(remaining)
+            batch = self._updates[:limit]
+        return 200, {"ok": True, "result": batch}
+    
+    
+    def _api_getMe(self, params):
+        return 200, {"ok": True, "result": {"id": 1, "is_bot": True,
+                                            "first_name": "Mock Bot",
+                                            "username": "mock_bot"}}
+    
+    
+    def _api_setWebhook(self, params):
+        return 200, {"ok": True, "result": True, "description": "Webhook was set"}
+    
+    
+    def _api_deleteWebhook(self, params):
+        return 200, {"ok": True, "result": True, "description": "Webhook was deleted"}
+    
+    
+    def stats(self):
+        """
+        Server counters
+        
+        Returns:
+            dict: calls (per method), errors (per error_code),
+                injected_errors, floods, pending_updates
+        """
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "errors": dict(self.errors),
+                "injected_errors": self.injected_errors,
+                "floods": self.floods,
+                "pending_updates": len(self._updates)
+            }
+
+
+# ==================== LOAD TEST ====================
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile
+    
+    Args:
+        values (list): Sorted samples
+        q (float): Percentile (0-100)
+    
+    Returns:
+        float: Sample at that rank (0.0 if there are none)
+    """
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def build_demo_bot(kb, pages=20):
+    """
+    Pagination bot used by default: /start sends page 1, page_N edits
+    
+    Args:
+        kb (TelegramKeyboard): Client under test
+        pages (int): Pages in the pagination keyboard
+    
+    Returns:
+        callable: handler(update)
+    """
+    router = Router()
+    
+    @router.command("start")
+    def start(message, args):
+        kb.send_with_inline_keyboard(
+            message["chat"]["id"], f"Page 1 of {pages}",
+            kb.pagination_keyboard(1, pages, "page")
+        )
+    
+    @router.callback_prefix("page_", parse=int)
+    def page(callback, number):
+        kb.answer_callback_query(callback["id"])
+        message = callback["message"]
+        kb.edit_message(
+            message["chat"]["id"], message["message_id"], f"Page {number} of {pages}",
+            kb.create_inline_keyboard(kb.pagination_keyboard(number, pages, "page"))
+        )
+    
+    return router.dispatch
+
+
+class LoadTest:
+    """
+    Simulated users driving a bot through MockBotAPI and a Poller
+    
+    Each user repeatedly sends /start, then clicks `clicks` callback
+    buttons on the reply, waiting for the bot's answer each time.
+    Latency is measured from injecting the update to the bot's
+    response reaching the server.
+    
+    Example:
+        report = LoadTest(users=200, duration=30).run()
+        print(report["latency_ms"]["callback"]["p99"])
+    """
+    
+    def __init__(self, users=50, duration=10.0, think_time=0.2, clicks=3,
+                 workers=8, reply_timeout=10.0, api=None,
+                 bot_factory=build_demo_bot, client_kwargs=None):
+        """
+        Args:
+            users (int): Concurrent simulated users
+            duration (float): Seconds to generate load
+            think_time (float): Mean pause between a user's actions
+            clicks (int): Button clicks after each /start
+            workers (int): ShardedDispatcher workers of the bot
+            reply_timeout (float): Seconds a user waits for a reply
+            api (MockBotAPI): Server to use (default: a fresh one)
+            bot_factory (callable): bot_factory(kb) -> handler(update)
+            client_kwargs (dict): TelegramKeyboard constructor arguments
+        """
+        self.users = users
+        self.duration = duration
+        self.think_time = think_time
+        self.clicks = clicks
+        self.workers = workers
+        self.reply_timeout = reply_timeout
+        self.api = api or MockBotAPI()
+        self.bot_factory = bot_factory
+        self.client_kwargs = client_kwargs or {}
+        
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._answers = {}
+        self._latencies = {"command": [], "callback": [], "answer": []}
+        self._timeouts = 0
+    
+    
+    def _on_request(self, method, params, payload):
+        """Match bot responses to the users waiting for them"""
+        now = time.monotonic()
+        if method == "answerCallbackQuery":
+            with self._lock:
+                pushed = self._answers.pop(str(params.get("callback_query_id")), None)
+                if pushed is not None:
+                    self._latencies["answer"].append(now - pushed)
+            return
+        if method not in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            return
+        
+        with self._lock:
+            waiter = self._waiting.pop(_chat_id(params.get("chat_id")), None)
+        if waiter is not None:
+            waiter["payload"] = payload
+            waiter["done"] = now
+            waiter["event"].set()
+    
+    
+    def _await(self, chat_id, kind, push):
+        """Inject an update and wait for the bot's response to it"""
+        waiter = {"event": threading.Event(), "payload": None}
+        with self._lock:
+            self._waiting[chat_id] = waiter
+        
+        pushed = time.monotonic()
+        update = push()
+        if kind == "callback":
+            with self._lock:
+                self._answers[update["callback_query"]["id"]] = pushed
+        
+        if not waiter["event"].wait(self.reply_timeout):
+            with self._lock:
+                self._waiting.pop(chat_id, None)
+                self._timeouts += 1
+            return None
+        
+        with self._lock:
+            self._latencies[kind].append(waiter["done"] - pushed)
+        return waiter["payload"]
+    
+    
+    def _user(self, chat_id, deadline):
+        """One simulated user's session loop"""
+        while time.monotonic() < deadline:
+            reply = self._await(chat_id, "command",
+                                lambda: self.api.push_message(chat_id, "/start"))
+            if not reply or not reply["ok"]:
+                continue
+            
+            message_id = reply["result"]["message_id"]
+            page = 1
+            for _ in range(self.clicks):
+                if time.monotonic() >= deadline:
+                    return
+                time.sleep(random.uniform(0, 2 * self.think_time))
+                # Clicking the current page would be a no-op edit
+                page = random.choice([p for p in range(1, 21) if p != page])
+                data = f"page_{page}"
+                self._await(chat_id, "callback",
+                            lambda: self.api.push_callback(chat_id, message_id, data))
+            time.sleep(random.uniform(0, 2 * self.think_time))
+    
+    
+    def run(self):
+        """
+        Run the load test
+        
+        Returns:
+            dict: duration, users, actions, throughput (actions/s),
+                requests_per_sec, timeouts, latency_ms (p50/p95/p99/max
+                per command, callback and answer), server and bot stats
+        """
+        self.api.on_request = self._on_request
+        if self.api.address is None:
+            self.api.start()
+        
+        kb = self.api.client(**self.client_kwargs)
+        dispatcher = ShardedDispatcher(self.bot_factory(kb), workers=self.workers)
+        poller = Poller(kb, timeout=1)
+        intake = threading.Thread(target=poller.run, args=(dispatcher.submit,),
+                                  name="load-test-poller", daemon=True)
+        intake.start()
+        
+        started = time.monotonic()
+        deadline = started + self.duration
+        users = [
+            threading.Thread(target=self._user, args=(100000 + i, deadline),
+                             name=f"load-test-user-{i}", daemon=True)
+            for i in range(self.users)
+        ]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.monotonic() - started
+        
+        poller.stop()
+        intake.join()
+        dispatcher.close()
+        server = self.api.stats()
+        self.api.stop()
+        kb.close()
+        
+        latency = {}
+        for kind, samples in self._latencies.items():
+            samples = sorted(samples)
+            latency[kind] = {
+                "count": len(samples),
+                "p50": percentile(samples, 50) * 1000,
+                "p95": percentile(samples, 95) * 1000,
+                "p99": percentile(samples, 99) * 1000,
+                "max": (samples[-1] if samples else 0.0) * 1000
+            }
+        actions = latency["command"]["count"] + latency["callback"]["count"]
+        requests = sum(count for method, count in server["calls"].items()
+                       if method != "getUpdates")
+        
+        return {
+            "duration": elapsed,
+            "users": self.users,
+            "actions": actions,
+            "throughput": actions / elapsed,
+            "requests_per_sec": requests / elapsed,
+            "timeouts": self._timeouts,
+            "latency_ms": latency,
+            "server": server,
+            "dispatcher": dispatcher.stats(),
+            "throttle": kb.throttle_stats()
+        }
+
+
+def print_report(report):
+    """Human-readable summary of LoadTest.run()"""
+    print(f"users {report['users']}  duration {report['duration']:.1f}s  "
+          f"actions {report['actions']}  timeouts {report['timeouts']}")
+    print(f"throughput {report['throughput']:.1f} actions/s  "
+          f"requests {report['requests_per_sec']:.1f}/s")
+    for kind, stats in report["latency_ms"].items():
+        print(f"{kind:9} n={stats['count']:<7} p50 {stats['p50']:8.1f} ms  "
+              f"p95 {stats['p95']:8.1f} ms  p99 {stats['p99']:8.1f} ms  "
+              f"max {stats['max']:8.1f} ms")
+    server = report["server"]
+    print(f"server calls {server['calls']}  errors {server['errors']}  "
+          f"floods {server['floods']}")
+
+
+# ==================== USAGE ====================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test a bot against a mock Bot API")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--think-time", type=float, default=0.2)
+    parser.add_argument("--clicks", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.03,
+                        help="server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--flood-rate", type=float,
+                        help="server-side sends/second before 429s")
+    parser.add_argument("--client-rate", type=float,
+                        help="client send rate (default: library default)")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+    
+    client_kwargs = {}
+    if args.client_rate:
+        client_kwargs["rate_controller"] = RateController(
+            rate=args.client_rate, max_rate=args.client_rate
+        )
+    
+    api = MockBotAPI(latency=args.latency, jitter=args.jitter,
+                     error_rate=args.error_rate, flood_rate=args.flood_rate)
+    report = LoadTest(users=args.users, duration=args.duration,
+                      think_time=args.think_time, clicks=args.clicks,
+                      workers=args.workers, api=api,
+                      client_kwargs=client_kwargs).run()
+    print_report(report)
+    
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,13 @@ setup(
     name="telegram-keyboard-expert",
     version="1.0.0",
     packages=find_packages(),
-    py_modules=["telegram_keyboard"], # Aapki main file ka naam
+    py_modules=["telegram_keyboard", "mock_bot_api"], # Aapki main file ka naam
     install_requires=[
         "requests",
     ],
+    extras_require={
+        "fast": ["orjson", "ujson"],
+    },
     author="Airdrop Wala",
     description="A complete Telegram keyboard library",
     long_description=open("README.md").read(),
@@ -17,5 +20,5 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
@@ -6,26 +6,610 @@ Author: Your Name
 Version: 1.0
 """
 
+import asyncio
+import base64
+import bisect
+import dbm
+import hashlib
+import heapq
+import hmac
 import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import re
+import signal
+import ssl
+import sys
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping, Sequence
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+)
+from enum import Enum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json.encoder import encode_basestring_ascii
+from string import Formatter
+from types import MappingProxyType
+from urllib.parse import urlencode, urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== PRESET CACHE ====================
+
+PresetEntry = namedtuple("PresetEntry", ["layout", "keyboard"])
+
+
+class PresetCache:
+    """Bounded LRU cache of preset layouts and their serialized markup"""
+    
+    def __init__(self, maxsize=256):
+        """
+        Args:
+            maxsize (int): Max cached entries
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    
+    def get(self, key):
+        """Return the entry for key (refreshing its LRU position) or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+    
+    
+    def put(self, key, entry):
+        """Store an entry, evicting the least recently used one"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    
+    def invalidate(self, preset=None):
+        """
+        Drop cached entries
+        
+        Args:
+            preset (str): Only drop entries of this preset (e.g.
+                'main_menu'); all entries when omitted
+        """
+        with self._lock:
+            if preset is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == preset]:
+                del self._entries[key]
+    
+    
+    def stats(self):
+        """
+        Cache counters
+        
+        Returns:
+            dict: hits, misses, size, maxsize
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize
+            }
+
+
+# Shared by all TelegramKeyboard instances
+preset_cache = PresetCache()
+
+
+def _hashable(value):
+    """Turn list arguments into tuples so they can be part of a cache key"""
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+def _cached_preset(container):
+    """
+    Attach a memoized `entry` lookup to a preset method
+    
+    Calling the preset still builds a fresh, mutable layout (callers
+    append rows to it, and building is cheaper than copying a cached
+    one). `method.entry(self, ...)` returns the PresetEntry from
+    preset_cache: the layout as tuples plus the ready-to-send markup
+    (layout wrapped by `container`, frozen).
+    
+    Args:
+        container (str): 'create_reply_keyboard' or 'create_inline_keyboard'
+    """
+    def decorator(method):
+        name = method.__name__
+        
+        def entry(self, *args, **kwargs):
+            key = (name, args, tuple(kwargs.items())) if kwargs else (name, args)
+            try:
+                cached = preset_cache.get(key)
+            except TypeError:
+                # Unhashable arguments (e.g. a custom_buttons list)
+                key = (name, _hashable(args), _hashable(tuple(kwargs.items())))
+                try:
+                    cached = preset_cache.get(key)
+                except TypeError:
+                    key = cached = None
+            
+            if cached is not None:
+                return cached
+            
+            layout = method(self, *args, **kwargs)
+            keyboard = FrozenKeyboard(getattr(self, container)(layout))
+            cached = PresetEntry(
+                tuple(tuple(row) for row in layout), keyboard
+            )
+            
+            if key is not None:
+                preset_cache.put(key, cached)
+            return cached
+        
+        method.entry = entry
+        return method
+    
+    return decorator
 
 
 class TelegramKeyboard:
     """Main class for Telegram Bot keyboard management"""
     
-    def __init__(self, bot_token):
+    def __init__(self, bot_token, pool_connections=10, pool_maxsize=10,
+                 max_retries=3, retry_backoff=0.3, keep_alive=True,
+                 pool_block=False, timeout=30, rate_controller=None,
+                 flood_retries=3, compact_buttons=False,
+                 edit_cache_size=10000, edit_cache_ttl=3600, json_body=True,
+                 lazy_responses=False, metrics=None):
         """
         Initialize with bot token
         
         Args:
             bot_token (str): Your Telegram Bot API token
+            pool_connections (int): Number of per-host pools to keep
+            pool_maxsize (int): Max connections kept open per host
+            max_retries (int): Retries for failed connects and 502/503/504
+            retry_backoff (float): Backoff factor between retries (seconds)
+            keep_alive (bool): Reuse connections between requests
+            pool_block (bool): Wait for a free connection instead of
+                opening an extra one when the pool is exhausted
+            timeout (float): Request timeout in seconds
+            rate_controller (RateController): Send-rate controller
+                (defaults to the one shared by all clients of this bot,
+                see shared_rate_controller)
+            flood_retries (int): Times a 429 response is retried after
+                waiting retry_after
+            compact_buttons (bool): Make create_*_button return interned
+                Button objects instead of dicts
+            edit_cache_size (int): Messages whose last sent content is
+                remembered to skip no-op edits (0 disables)
+            edit_cache_ttl (float): Seconds that content is remembered
+            json_body (bool): Send application/json bodies with the
+                markup nested as an object (False: form-encoded)
+            lazy_responses (bool): Return successful responses as
+                LazyResponse, parsed only when read
+            metrics (RequestMetrics): Record per-method latency, bytes
+                and error codes (None: no recording)
         """
         self.bot_token = bot_token
         self.base_url = f"https://api.telegram.org/bot{bot_token}"
+        
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.keep_alive = keep_alive
+        self.pool_block = pool_block
+        self.timeout = timeout
+        self.rate_controller = rate_controller or shared_rate_controller(bot_token)
+        self.flood_retries = flood_retries
+        self.compact_buttons = compact_buttons
+        self.json_body = json_body
+        self.lazy_responses = lazy_responses
+        self.metrics = metrics
+        self._hooks = ()
+        self.message_states = (
+            MessageStateCache(edit_cache_size, edit_cache_ttl)
+            if edit_cache_size else None
+        )
+        
+        # Session is created lazily so builder-only instances stay cheap
+        self._session = None
+        self._adapter = None
+        self._session_lock = threading.Lock()
+    
+    
+    # ==================== CONNECTION POOL ====================
+    
+    @property
+    def session(self):
+        """
+        Shared HTTP session (created on first use)
+        
+        Returns:
+            requests.Session: Pooled keep-alive session
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+    
+    
+    def _create_session(self):
+        """Build a session with a pooled, retrying adapter"""
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            status=self.max_retries,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST"]),
+            backoff_factor=self.retry_backoff,
+            raise_on_status=False,
+            respect_retry_after_header=False
+        )
+        
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+            pool_block=self.pool_block
+        )
+        
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        
+        self._adapter = adapter
+        return session
+    
+    
+    def _request(self, api_method, data, timeout=None, throttled=True,
+                 deadline=None):
+        """
+        Call a Bot API method over the shared session
+        
+        A 429 response is retried after retry_after seconds (up to
+        flood_retries times). Throttled requests also report it to the
+        rate controller.
+        
+        Args:
+            api_method (str): Bot API method name (e.g. 'sendMessage')
+            data (dict): Request parameters
+            timeout (float): Override the client timeout (long polling)
+            throttled (bool): Pace with the rate controller (sends
+                covered by Telegram's broadcast limit)
+            deadline (float): time.monotonic() value; a 429 whose
+                retry_after ends later is returned, not retried
+        
+        Returns:
+            dict: Response from Telegram API
+        """
+        url = f"{self.base_url}/{api_method}"
+        timeout = timeout or self.timeout
+        body, content_type = self._encode_body(data)
+        headers = {"Content-Type": content_type}
+        
+        attempt = 0
+        while True:
+            if throttled:
+                self.rate_controller.acquire()
+            started = time.perf_counter()
+            hooked = None
+            if self._hooks:
+                hooked = self._start_hooks(api_method, data, body, attempt)
+            try:
+                response = self.session.post(url, data=body, headers=headers,
+                                             timeout=timeout)
+            except Exception as e:
+                if self.metrics is not None or hooked is not None:
+                    self._observe(api_method, started, body, b"", error=e,
+                                  hooked=hooked)
+                raise
+            content = response.content
+            
+            lazy = self.lazy_responses and _is_ok_body(content)
+            result = LazyResponse(content) if lazy else _json_loads(content)
+            if self.metrics is not None or hooked is not None:
+                self._observe(api_method, started, body, content, result,
+                              hooked=hooked)
+            
+            retry_after = None if lazy else _retry_after(result)
+            if retry_after is None:
+                if throttled:
+                    self.rate_controller.on_success()
+                return result
+            
+            if throttled:
+                self.rate_controller.on_flood(retry_after)
+            if attempt >= self.flood_retries or (
+                    deadline is not None
+                    and time.monotonic() + retry_after > deadline):
+                return result
+            attempt += 1
+            time.sleep(retry_after)
+    
+    
+    def add_hook(self, before=None, after=None, error=None, sample_rate=1.0):
+        """
+        Register request lifecycle callbacks (see RequestHook)
+        
+        Args:
+            before (callable): before(event), right before sending
+            after (callable): after(event), after an ok response
+            error (callable): error(event), after a failed request
+            sample_rate (float): Fraction of requests hooked (0-1)
+        
+        Returns:
+            RequestHook: Handle for remove_hook()
+        
+        Example:
+            kb.add_hook(after=lambda e: log.info("%s %.3fs", e.api_method,
+                                                 e.duration),
+                        sample_rate=0.01)
+        """
+        hook = RequestHook(before, after, error, sample_rate)
+        # Copy-on-write, so requests in flight never see a half update
+        self._hooks = self._hooks + (hook,)
+        return hook
+    
+    
+    def remove_hook(self, hook):
+        """
+        Unregister a hook returned by add_hook()
+        
+        Args:
+            hook (RequestHook): Hook to remove
+        """
+        self._hooks = tuple(h for h in self._hooks if h is not hook)
+    
+    
+    def _start_hooks(self, api_method, data, body, attempt):
+        """
+        Pick the sampled hooks for one attempt and run their before()
+        
+        Returns:
+            tuple: (event, hooks), or None if no hook sampled it
+        """
+        hooks = [hook for hook in self._hooks if hook.sampled()]
+        if not hooks:
+            return None
+        
+        event = RequestEvent(api_method, data.get("chat_id"), len(body), attempt)
+        for hook in hooks:
+            _call_hook(hook.before, event)
+        return event, hooks
+    
+    
+    def _observe(self, api_method, started, body, content, result=None,
+                 error=None, hooked=None):
+        """
+        Report one finished HTTP attempt to metrics and hooks
+        
+        Args:
+            result (dict): Decoded response, if there is one
+            error: Exception raised, or HTTP status of a body-less failure
+            hooked (tuple): _start_hooks() result
+        """
+        duration = time.perf_counter() - started
+        if isinstance(error, BaseException):
+            code = type(error).__name__
+        elif result is not None:
+            code = None if result.get("ok") else result.get("error_code")
+        else:
+            code = error
+        
+        if self.metrics is not None:
+            self.metrics.observe(api_method, duration, len(body), len(content), code)
+        
+        if hooked is not None:
+            event, hooks = hooked
+            event.duration = duration
+            event.response_bytes = len(content)
+            event.result = result
+            event.error = code
+            if isinstance(error, BaseException):
+                event.exception = error
+            for hook in hooks:
+                _call_hook(hook.error if code is not None else hook.after, event)
+    
+    
+    def _encode_body(self, data):
+        """
+        Encode request parameters for the wire
+        
+        Returns:
+            tuple: (body bytes, Content-Type header)
+        """
+        if self.json_body:
+            return _json_body(data), "application/json"
+        
+        body = urlencode(
+            {key: value for key, value in data.items() if value is not None}
+        )
+        return body.encode("ascii"), "application/x-www-form-urlencoded"
+    
+    
+    def _is_noop_edit(self, key, state):
+        """Whether an edit to state would not change the message"""
+        skipped = self.message_states.get(key) == state
+        self.message_states.record(skipped)
+        return skipped
+    
+    
+    def _remember_state(self, key, state, result):
+        """Record content Telegram now shows for a message"""
+        if result.get("ok"):
+            self.message_states.put(key, state)
+        elif "message is not modified" in result.get("description", ""):
+            # Telegram rejected it because the message already shows state
+            self.message_states.put(key, state)
+    
+    
+    def _remember_sent(self, chat_id, data, result):
+        """Seed the edit cache with a freshly sent message"""
+        if isinstance(result, LazyResponse) and not result.parsed:
+            # Not worth parsing just for the message_id
+            return
+        message = result.get("result")
+        if result.get("ok") and isinstance(message, dict):
+            key = _state_key(chat_id, message.get("message_id"))
+            self.message_states.put(key, _message_state(data))
+    
+    
+    def _plan_edit(self, chat_id, message_id, text, keyboard,
+                   inline_message_id, force):
+        """
+        Pick the cheapest edit that brings a message to the new content
+        
+        Returns:
+            tuple: (api_method, data, key, state); api_method is None for
+                a no-op edit, key is None when the cache is disabled
+        """
+        data = self._edit_payload(chat_id, message_id, text, keyboard,
+                                  inline_message_id)
+        if self.message_states is None:
+            if text is None:
+                return "editMessageReplyMarkup", data, None, None
+            return "editMessageText", data, None, None
+        
+        key = _state_key(chat_id, message_id, inline_message_id)
+        cached = self.message_states.get(key)
+        
+        if text is None:
+            # Markup-only edit; the full state is known only if cached
+            markup = _digest(data.get("reply_markup", ""))
+            state = (cached[0], markup) if cached is not None else None
+            if not force and cached is not None and cached[1] == markup:
+                self.message_states.record(True)
+                return None, data, key, state
+            self.message_states.record(False)
+            return "editMessageReplyMarkup", data, key, state
+        
+        state = _message_state(data)
+        if not force and cached == state:
+            self.message_states.record(True)
+            return None, data, key, state
+        self.message_states.record(False)
+        
+        if not force and cached is not None and cached[0] == state[0]:
+            # Same text: send only the keyboard
+            del data["text"]
+            return "editMessageReplyMarkup", data, key, state
+        return "editMessageText", data, key, state
+    
+    
+    def edit_cache_stats(self):
+        """
+        No-op edit cache counters
+        
+        Returns:
+            dict: hits, misses, hit_ratio, size, maxsize (empty if disabled)
+        """
+        if self.message_states is None:
+            return {}
+        return self.message_states.stats()
+    
+    
+    def throttle_stats(self):
+        """
+        Flood-control state of this client's rate controller
+        
+        Returns:
+            dict: rate, max_rate, throttled, blocked_for, flood_count
+        """
+        return self.rate_controller.stats()
+    
+    
+    def pool_stats(self):
+        """
+        Connection reuse counters for the pools currently held
+        
+        A miss is a request that had to open a new connection,
+        a hit is a request served by an already open one.
+        
+        Returns:
+            dict: connections, requests, hits, misses
+        """
+        connections = 0
+        requests_made = 0
+        
+        if self._adapter is not None:
+            pools = self._adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                requests_made += pool.num_requests
+        
+        return {
+            "connections": connections,
+            "requests": requests_made,
+            "hits": max(requests_made - connections, 0),
+            "misses": connections
+        }
+    
+    
+    def close(self):
+        """Close all pooled connections"""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._adapter = None
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
     
     
     # ==================== REPLY KEYBOARDS ====================
     
+    def _button(self, button):
+        """Return a button dict, or its interned Button when compact"""
+        if self.compact_buttons:
+            return Button.from_dict(button)
+        return button
+    
+    
     def create_reply_keyboard(self, buttons, resize=True, one_time=False, 
                              selective=False, placeholder=None):
         """
@@ -78,10 +662,10 @@ class TelegramKeyboard:
         Returns:
             dict: Contact button
         """
-        return {
+        return self._button({
             "text": text,
             "request_contact": True
-        }
+        })
     
     
     def create_location_button(self, text):
@@ -94,10 +678,10 @@ class TelegramKeyboard:
         Returns:
             dict: Location button
         """
-        return {
+        return self._button({
             "text": text,
             "request_location": True
-        }
+        })
     
     
     def create_poll_button(self, text, poll_type="regular"):
@@ -111,12 +695,12 @@ class TelegramKeyboard:
         Returns:
             dict: Poll button
         """
-        return {
+        return self._button({
             "text": text,
             "request_poll": {
                 "type": poll_type
             }
-        }
+        })
     
     
     def create_web_app_button(self, text, url):
@@ -130,12 +714,12 @@ class TelegramKeyboard:
         Returns:
             dict: Web App button
         """
-        return {
+        return self._button({
             "text": text,
             "web_app": {
                 "url": url
             }
-        }
+        })
     
     
     def remove_keyboard(self):
@@ -177,10 +761,10 @@ class TelegramKeyboard:
         Returns:
             dict: Callback button
         """
-        return {
+        return self._button({
             "text": text,
             "callback_data": callback_data
-        }
+        })
     
     
     def create_url_button(self, text, url):
@@ -194,10 +778,10 @@ class TelegramKeyboard:
         Returns:
             dict: URL button
         """
-        return {
+        return self._button({
             "text": text,
             "url": url
-        }
+        })
     
     
     def create_login_button(self, text, url):
@@ -211,12 +795,12 @@ class TelegramKeyboard:
         Returns:
             dict: Login button
         """
-        return {
+        return self._button({
             "text": text,
             "login_url": {
                 "url": url
             }
-        }
+        })
     
     
     def create_switch_inline_button(self, text, query="", current_chat=False):
@@ -232,15 +816,15 @@ class TelegramKeyboard:
             dict: Switch inline button
         """
         if current_chat:
-            return {
+            return self._button({
                 "text": text,
                 "switch_inline_query_current_chat": query
-            }
+            })
         else:
-            return {
+            return self._button({
                 "text": text,
                 "switch_inline_query": query
-            }
+            })
     
     
     def create_game_button(self, text):
@@ -253,10 +837,10 @@ class TelegramKeyboard:
         Returns:
             dict: Game button
         """
-        return {
+        return self._button({
             "text": text,
             "callback_game": {}
-        }
+        })
     
     
     def create_pay_button(self, text):
@@ -269,29 +853,35 @@ class TelegramKeyboard:
         Returns:
             dict: Pay button
         """
-        return {
+        return self._button({
             "text": text,
             "pay": True
-        }
+        })
     
     
-    # ==================== SEND MESSAGE METHODS ====================
+    # ==================== FROZEN KEYBOARDS ====================
     
-    def send_message(self, chat_id, text, keyboard=None, parse_mode=None):
+    def freeze(self, keyboard, name=None):
         """
-        Send message with optional keyboard
+        Freeze a keyboard so its JSON is serialized only once
         
         Args:
-            chat_id (int/str): Chat ID
-            text (str): Message text
-            keyboard (dict): Keyboard markup (optional)
-            parse_mode (str): 'HTML' or 'Markdown' (optional)
+            keyboard (dict): Keyboard markup
+            name (str): Also register under this id (optional),
+                so it can be sent as keyboard="<id>"
         
         Returns:
-            dict: Response from Telegram API
+            FrozenKeyboard: Immutable keyboard with cached JSON
         """
-        url = f"{self.base_url}/sendMessage"
-        
+        if name is not None:
+            return register_keyboard(name, keyboard)
+        return FrozenKeyboard(keyboard)
+    
+    
+    # ==================== REQUEST PAYLOADS ====================
+    
+    def _message_payload(self, chat_id, text, keyboard=None, parse_mode=None):
+        """Build sendMessage parameters"""
         data = {
             "chat_id": chat_id,
             "text": text
@@ -301,10 +891,84 @@ class TelegramKeyboard:
             data["parse_mode"] = parse_mode
         
         if keyboard:
-            data["reply_markup"] = json.dumps(keyboard)
+            data["reply_markup"] = serialize_markup(keyboard)
+        
+        return data
+    
+    
+    def _callback_answer_payload(self, callback_query_id, text=None,
+                                 show_alert=False, url=None):
+        """Build answerCallbackQuery parameters"""
+        data = {
+            "callback_query_id": callback_query_id,
+            "show_alert": show_alert
+        }
+        
+        if text:
+            data["text"] = text
+        
+        if url:
+            data["url"] = url
+        
+        return data
+    
+    
+    def _edit_payload(self, chat_id, message_id, text, keyboard=None,
+                      inline_message_id=None):
+        """Build editMessageText / editMessageReplyMarkup parameters"""
+        if inline_message_id is not None:
+            data = {"inline_message_id": inline_message_id}
+        else:
+            data = {"chat_id": chat_id, "message_id": message_id}
+        
+        if text is not None:
+            data["text"] = text
+        
+        if keyboard:
+            data["reply_markup"] = serialize_markup(keyboard)
+        
+        return data
+    
+    
+    def _updates_payload(self, offset=None, limit=100, timeout=30,
+                         allowed_updates=None):
+        """Build getUpdates parameters"""
+        data = {
+            "limit": limit,
+            "timeout": timeout
+        }
+        
+        if offset is not None:
+            data["offset"] = offset
         
-        response = requests.post(url, data=data)
-        return response.json()
+        if allowed_updates is not None:
+            data["allowed_updates"] = _json_dumps(list(allowed_updates))
+        
+        return data
+    
+    
+    # ==================== SEND MESSAGE METHODS ====================
+    
+    def send_message(self, chat_id, text, keyboard=None, parse_mode=None):
+        """
+        Send message with optional keyboard
+        
+        Args:
+            chat_id (int/str): Chat ID
+            text (str): Message text
+            keyboard (dict/FrozenKeyboard/str): Keyboard markup, frozen
+                keyboard or registered keyboard id (optional)
+            parse_mode (str): 'HTML' or 'Markdown' (optional)
+        
+        Returns:
+            dict: Response from Telegram API
+        """
+        data = self._message_payload(chat_id, text, keyboard, parse_mode)
+        result = self._request("sendMessage", data)
+        
+        if self.message_states is not None:
+            self._remember_sent(chat_id, data, result)
+        return result
     
     
     def send_with_reply_keyboard(self, chat_id, text, buttons, **kwargs):
@@ -356,6 +1020,26 @@ class TelegramKeyboard:
         return self.send_message(chat_id, text, keyboard)
     
     
+    def broadcast(self, chat_ids, text, keyboard=None, parse_mode=None,
+                  **options):
+        """
+        Send the same message to many chats within rate limits
+        
+        Args:
+            chat_ids (iterable): Chat IDs
+            text (str): Message text
+            keyboard (dict): Keyboard markup (optional)
+            parse_mode (str): 'HTML' or 'Markdown' (optional)
+            **options: Broadcaster options (global_rate, per_chat_rate,
+                concurrency, max_tracked_chats)
+        
+        Returns:
+            generator: BroadcastResult per chat as sends complete
+        """
+        broadcaster = Broadcaster(self, **options)
+        return broadcaster.run(chat_ids, text, keyboard, parse_mode)
+    
+    
     # ==================== CALLBACK QUERY ====================
     
     def answer_callback_query(self, callback_query_id, text=None, 
@@ -372,53 +1056,196 @@ class TelegramKeyboard:
         Returns:
             dict: API response
         """
-        url_endpoint = f"{self.base_url}/answerCallbackQuery"
-        
-        data = {
-            "callback_query_id": callback_query_id,
-            "show_alert": show_alert
-        }
-        
-        if text:
-            data["text"] = text
-        
-        if url:
-            data["url"] = url
-        
-        response = requests.post(url_endpoint, data=data)
-        return response.json()
+        data = self._callback_answer_payload(callback_query_id, text,
+                                             show_alert, url)
+        return self._request("answerCallbackQuery", data, throttled=False)
     
     
-    def edit_message_text(self, chat_id, message_id, text, keyboard=None):
+    def edit_message_text(self, chat_id, message_id, text, keyboard=None,
+                          force=False, inline_message_id=None):
         """
         Edit message text (for inline keyboards)
         
+        An edit identical to the content last sent to this message is
+        answered locally with {"ok": True, "result": None,
+        "not_modified": True} instead of calling Telegram.
+        
         Args:
             chat_id: Chat ID
             message_id: Message ID to edit
             text: New text
             keyboard: New keyboard (optional)
+            force (bool): Send even if the content looks unchanged
+            inline_message_id (str): Edit an inline-mode message instead
+                (chat_id and message_id are then ignored)
         
         Returns:
             dict: API response
         """
-        url = f"{self.base_url}/editMessageText"
+        data = self._edit_payload(chat_id, message_id, text, keyboard,
+                                  inline_message_id)
         
-        data = {
-            "chat_id": chat_id,
-            "message_id": message_id,
-            "text": text
-        }
+        if self.message_states is None:
+            return self._request("editMessageText", data, throttled=False)
         
-        if keyboard:
-            data["reply_markup"] = json.dumps(keyboard)
+        key = _state_key(chat_id, message_id, inline_message_id)
+        state = _message_state(data)
+        if not force and self._is_noop_edit(key, state):
+            return _not_modified_response()
+        
+        result = self._request("editMessageText", data, throttled=False)
+        self._remember_state(key, state, result)
+        return result
+    
+    
+    def edit_message_reply_markup(self, chat_id=None, message_id=None,
+                                  keyboard=None, inline_message_id=None,
+                                  force=False):
+        """
+        Replace only the inline keyboard of a message
+        
+        The text is not resent, so toggling a button or turning a page
+        under a long message costs just the markup.
+        
+        Args:
+            chat_id: Chat ID
+            message_id: Message ID to edit
+            keyboard: New inline keyboard (None removes it)
+            inline_message_id (str): Edit an inline-mode message instead
+            force (bool): Send even if the keyboard looks unchanged
+        
+        Returns:
+            dict: API response
+        """
+        return self.edit_message(chat_id, message_id, None, keyboard,
+                                 inline_message_id=inline_message_id,
+                                 force=force)
+    
+    
+    def edit_message(self, chat_id=None, message_id=None, text=None,
+                     keyboard=None, inline_message_id=None, force=False):
+        """
+        Edit a message using the cheapest API call
+        
+        Compares the new content with what was last sent to the message:
+        nothing changed -> no request (not_modified=True); only the
+        keyboard changed -> editMessageReplyMarkup; otherwise
+        editMessageText. With text=None only the keyboard is edited.
+        
+        Args:
+            chat_id: Chat ID
+            message_id: Message ID to edit
+            text: New text (None keeps the current text)
+            keyboard: New inline keyboard (optional)
+            inline_message_id (str): Edit an inline-mode message instead
+            force (bool): Skip the no-op check and resend the text
+        
+        Returns:
+            dict: API response
+        """
+        method, data, key, state = self._plan_edit(
+            chat_id, message_id, text, keyboard, inline_message_id, force
+        )
+        if method is None:
+            return _not_modified_response()
+        
+        result = self._request(method, data, throttled=False)
+        if state is not None:
+            self._remember_state(key, state, result)
+        return result
+    
+    
+    # ==================== UPDATES ====================
+    
+    def get_updates(self, offset=None, limit=100, timeout=30,
+                    allowed_updates=None):
+        """
+        Long-poll for incoming updates
+        
+        Args:
+            offset (int): First update_id to return
+            limit (int): Max updates per call (1-100)
+            timeout (int): Seconds the server may hold the request
+            allowed_updates (list): Update types to receive (optional)
+        
+        Returns:
+            dict: API response
+        """
+        data = self._updates_payload(offset, limit, timeout, allowed_updates)
+        return self._request("getUpdates", data, timeout=timeout + 10,
+                             throttled=False)
+    
+    
+    def set_webhook(self, url, secret_token=None, allowed_updates=None,
+                    max_connections=None, drop_pending_updates=False):
+        """
+        Point Telegram at a webhook URL (see WebhookReceiver)
+        
+        Args:
+            url (str): HTTPS URL Telegram will POST updates to
+            secret_token (str): Sent back in X-Telegram-Bot-Api-Secret-Token
+            allowed_updates (list): Update types to receive (optional)
+            max_connections (int): Max parallel deliveries (1-100)
+            drop_pending_updates (bool): Discard queued updates
+        
+        Returns:
+            dict: API response
+        """
+        data = {"url": url}
+        
+        if secret_token:
+            data["secret_token"] = secret_token
+        
+        if allowed_updates is not None:
+            data["allowed_updates"] = _json_dumps(list(allowed_updates))
+        
+        if max_connections:
+            data["max_connections"] = max_connections
+        
+        if drop_pending_updates:
+            data["drop_pending_updates"] = True
         
-        response = requests.post(url, data=data)
-        return response.json()
+        return self._request("setWebhook", data, throttled=False)
+    
+    
+    def delete_webhook(self, drop_pending_updates=False):
+        """
+        Remove the webhook (required before using getUpdates again)
+        
+        Args:
+            drop_pending_updates (bool): Discard queued updates
+        
+        Returns:
+            dict: API response
+        """
+        data = {}
+        
+        if drop_pending_updates:
+            data["drop_pending_updates"] = True
+        
+        return self._request("deleteWebhook", data, throttled=False)
     
     
     # ==================== PRESET KEYBOARDS ====================
     
+    def preset_keyboard(self, preset, *args, **kwargs):
+        """
+        Ready-to-send markup for a preset, served from preset_cache
+        
+        Args:
+            preset (str): Preset method name (e.g. 'main_menu')
+            *args, **kwargs: Preset arguments
+        
+        Returns:
+            FrozenKeyboard: Reply (or inline, for pagination) markup
+        
+        Example:
+            kb.send_message(chat_id, "Menu:", kb.preset_keyboard("main_menu"))
+        """
+        return getattr(type(self), preset).entry(self, *args, **kwargs).keyboard
+    
+    
+    @_cached_preset("create_reply_keyboard")
     def main_menu(self, register=True, login=True, help=True, custom_buttons=None):
         """
         Create common main menu keyboard
@@ -457,6 +1284,7 @@ class TelegramKeyboard:
         return buttons
     
     
+    @_cached_preset("create_reply_keyboard")
     def yes_no_keyboard(self, yes_text="✅ Yes", no_text="❌ No"):
         """
         Create Yes/No keyboard
@@ -471,6 +1299,7 @@ class TelegramKeyboard:
         return [[yes_text, no_text]]
     
     
+    @_cached_preset("create_reply_keyboard")
     def back_button(self, text="🔙 Back"):
         """
         Create back button keyboard
@@ -484,6 +1313,7 @@ class TelegramKeyboard:
         return [[text]]
     
     
+    @_cached_preset("create_reply_keyboard")
     def number_keyboard(self, start=1, end=9, columns=3):
         """
         Create number keyboard
@@ -512,7 +1342,9 @@ class TelegramKeyboard:
         return buttons
     
     
-    def pagination_keyboard(self, current_page, total_pages, callback_prefix="page"):
+    @_cached_preset("create_inline_keyboard")
+    def pagination_keyboard(self, current_page, total_pages, callback_prefix="page",
+                            codec=None):
         """
         Create pagination inline keyboard
         
@@ -520,10 +1352,17 @@ class TelegramKeyboard:
             current_page (int): Current page number
             total_pages (int): Total pages
             callback_prefix (str): Callback data prefix
+            codec (CallbackCodec): Encode the target page with this
+                single-field codec instead of '<prefix>_<page>' (optional)
         
         Returns:
             list: Inline button layout
         """
+        if codec is not None:
+            page_data = codec.encode
+        else:
+            page_data = lambda page: f"{callback_prefix}_{page}"
+        
         buttons = []
         row = []
         
@@ -531,7 +1370,7 @@ class TelegramKeyboard:
         if current_page > 1:
             row.append(self.create_callback_button(
                 "⬅️ Previous",
-                f"{callback_prefix}_{current_page - 1}"
+                page_data(current_page - 1)
             ))
         
         # Page indicator
@@ -544,16 +1383,4212 @@ class TelegramKeyboard:
         if current_page < total_pages:
             row.append(self.create_callback_button(
                 "Next ➡️",
-                f"{callback_prefix}_{current_page + 1}"
+                page_data(current_page + 1)
             ))
         
         buttons.append(row)
         return buttons
 
 
+# ==================== ASYNC CLIENT ====================
+
+class _ConnectFailed(ConnectionError):
+    """A connection could not be opened, so the request was never sent"""
+
+
+class _StaleConnection(ConnectionError):
+    """Connection closed before any response byte (idle keep-alive drop)"""
+
+
+class _AsyncConnectionPool:
+    """Keep-alive HTTP/1.1 connection pool for a single host (asyncio)"""
+    
+    def __init__(self, base_url, maxsize=100, timeout=30, keep_alive=True):
+        """
+        Args:
+            base_url (str): Base URL every request path is appended to
+            maxsize (int): Max connections (and requests in flight)
+            timeout (float): Per-request timeout in seconds
+            keep_alive (bool): Return connections to the pool after use
+        """
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.path_prefix = parts.path.rstrip("/")
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        
+        self._ssl = ssl.create_default_context() if self.scheme == "https" else None
+        self._idle = []
+        self._semaphore = asyncio.Semaphore(maxsize)
+        self._closed = False
+        
+        self.hits = 0
+        self.misses = 0
+    
+    
+    async def _acquire(self):
+        """Reuse an idle connection or open a new one"""
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                self.hits += 1
+                return reader, writer, True
+            writer.close()
+        
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self._ssl),
+                self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise _ConnectFailed(e) from e
+        self.misses += 1
+        return reader, writer, False
+    
+    
+    def _release(self, reader, writer, reusable):
+        """Return a connection to the pool or close it"""
+        if reusable and self.keep_alive and not self._closed:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+    
+    
+    async def _exchange(self, reader, writer, method, path, body, content_type):
+        """Write one request and read its response"""
+        head = (
+            f"{method} {self.path_prefix}/{path} HTTP/1.1\r\n"
+            f"Host: {self.host}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if self.keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        try:
+            writer.write(head.encode("latin-1") + body)
+            await writer.drain()
+            status_line = await reader.readline()
+        except ConnectionError as e:
+            raise _StaleConnection(str(e)) from e
+        if not status_line:
+            raise _StaleConnection("Connection closed by server")
+        status = int(status_line.split()[1])
+        
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            payload = b"".join(chunks)
+        elif "content-length" in headers:
+            payload = await reader.readexactly(int(headers["content-length"]))
+        else:
+            payload = await reader.read()
+            headers["connection"] = "close"
+        
+        reusable = headers.get("connection", "").lower() != "close"
+        return status, payload, reusable
+    
+    
+    async def request(self, method, path, body=b"",
+                      content_type="application/x-www-form-urlencoded",
+                      timeout=None):
+        """
+        Send a request over a pooled connection
+        
+        A reused connection closed before any response byte arrived
+        is stale and retried on a fresh connection; once part of the
+        response was read the server has the request, so any error is
+        raised. Failing to open a connection raises
+        _ConnectFailed, the only error after which the request is known
+        not to have reached the server.
+        
+        Args:
+            method (str): HTTP method
+            path (str): Path relative to the base URL
+            body (bytes): Request body
+            content_type (str): Content-Type header
+            timeout (float): Override the pool timeout
+        
+        Returns:
+            tuple: (status code, response body bytes)
+        """
+        async with self._semaphore:
+            while True:
+                reader, writer, reused = await self._acquire()
+                try:
+                    status, payload, reusable = await asyncio.wait_for(
+                        self._exchange(reader, writer, method, path,
+                                       body, content_type),
+                        timeout or self.timeout
+                    )
+                except _StaleConnection:
+                    writer.close()
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                
+                self._release(reader, writer, reusable)
+                return status, payload
+    
+    
+    async def close(self):
+        """Close all idle connections"""
+        self._closed = True
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+
+class AsyncTelegramKeyboard(TelegramKeyboard):
+    """
+    asyncio counterpart of TelegramKeyboard
+    
+    Builders and presets are inherited unchanged; network methods
+    are coroutines sharing one keep-alive connection pool.
+    """
+    
+    def __init__(self, bot_token, pool_maxsize=100, max_retries=3,
+                 retry_backoff=0.3, keep_alive=True, timeout=30,
+                 rate_controller=None, flood_retries=3,
+                 edit_cache_size=10000, edit_cache_ttl=3600, json_body=True,
+                 lazy_responses=False, metrics=None):
+        """
+        Initialize with bot token
+        
+        Args:
+            bot_token (str): Your Telegram Bot API token
+            pool_maxsize (int): Max connections / concurrent requests
+            max_retries (int): Retries for failed connects
+            retry_backoff (float): Backoff factor between retries (seconds)
+            keep_alive (bool): Reuse connections between requests
+            timeout (float): Request timeout in seconds
+            rate_controller (RateController): Send-rate controller
+                (defaults to the one shared by all clients of this bot,
+                see shared_rate_controller)
+            flood_retries (int): Times a 429 response is retried
+            edit_cache_size (int): Messages remembered to skip no-op
+                edits (0 disables)
+            edit_cache_ttl (float): Seconds that content is remembered
+            json_body (bool): Send application/json bodies (False:
+                form-encoded)
+            lazy_responses (bool): Return successful responses as
+                LazyResponse, parsed only when read
+            metrics (RequestMetrics): Record per-method latency, bytes
+                and error codes (None: no recording)
+        """
+        super().__init__(
+            bot_token,
+            pool_maxsize=pool_maxsize,
+            max_retries=max_retries,
+            retry_backoff=retry_backoff,
+            keep_alive=keep_alive,
+            timeout=timeout,
+            rate_controller=rate_controller,
+            flood_retries=flood_retries,
+            edit_cache_size=edit_cache_size,
+            edit_cache_ttl=edit_cache_ttl,
+            json_body=json_body,
+            lazy_responses=lazy_responses,
+            metrics=metrics
+        )
+        self._pool = None
+    
+    
+    # ==================== CONNECTION POOL ====================
+    
+    @property
+    def pool(self):
+        """
+        Shared async connection pool (created on first use)
+        
+        Returns:
+            _AsyncConnectionPool: Pool bound to the running event loop
+        """
+        if self._pool is None:
+            self._pool = _AsyncConnectionPool(
+                self.base_url,
+                maxsize=self.pool_maxsize,
+                timeout=self.timeout,
+                keep_alive=self.keep_alive
+            )
+        return self._pool
+    
+    
+    async def _request(self, api_method, data, timeout=None, throttled=True,
+                       deadline=None):
+        """
+        Call a Bot API method over the shared pool
+        
+        Failed connects and 502/503/504 responses are retried up to
+        max_retries times; a timeout or dropped connection after the
+        request was sent is raised, since Telegram may have acted on it.
+        
+        Args:
+            api_method (str): Bot API method name (e.g. 'sendMessage')
+            data (dict): Request parameters
+            timeout (float): Override the client timeout (long polling)
+            throttled (bool): Pace with the rate controller (sends
+                covered by Telegram's broadcast limit)
+            deadline (float): time.monotonic() value; a 429 whose
+                retry_after ends later is returned, not retried
+        
+        Returns:
+            dict: Response from Telegram API
+        """
+        body, content_type = self._encode_body(data)
+        
+        attempt = 0
+        floods = 0
+        while True:
+            if throttled:
+                await self.rate_controller.acquire_async()
+            started = time.perf_counter()
+            hooked = None
+            if self._hooks:
+                hooked = self._start_hooks(api_method, data, body, attempt + floods)
+            try:
+                status, payload = await self.pool.request(
+                    "POST", api_method, body, content_type, timeout=timeout
+                )
+            except _ConnectFailed as e:
+                # Never sent, so safe to retry. Errors after the request
+                # went out are not: Telegram may already have it, and a
+                # second sendMessage would be a duplicate message
+                if self.metrics is not None or hooked is not None:
+                    self._observe(api_method, started, body, b"",
+                                  error=e.__cause__, hooked=hooked)
+                if attempt >= self.max_retries:
+                    raise e.__cause__
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+                attempt += 1
+                continue
+            except Exception as e:
+                if self.metrics is not None or hooked is not None:
+                    self._observe(api_method, started, body, b"", error=e,
+                                  hooked=hooked)
+                raise
+            
+            if status in (502, 503, 504) and attempt < self.max_retries:
+                if self.metrics is not None or hooked is not None:
+                    self._observe(api_method, started, body, payload,
+                                  error=status, hooked=hooked)
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+                attempt += 1
+                continue
+            
+            lazy = self.lazy_responses and _is_ok_body(payload)
+            result = LazyResponse(payload) if lazy else _json_loads(payload)
+            if self.metrics is not None or hooked is not None:
+                self._observe(api_method, started, body, payload, result,
+                              hooked=hooked)
+            
+            retry_after = None if lazy else _retry_after(result)
+            if retry_after is None:
+                if throttled:
+                    self.rate_controller.on_success()
+                return result
+            
+            if throttled:
+                self.rate_controller.on_flood(retry_after)
+            if floods >= self.flood_retries or (
+                    deadline is not None
+                    and time.monotonic() + retry_after > deadline):
+                return result
+            floods += 1
+            await asyncio.sleep(retry_after)
+    
+    
+    def pool_stats(self):
+        """
+        Connection reuse counters
+        
+        Returns:
+            dict: connections, requests, hits, misses
+        """
+        hits = self._pool.hits if self._pool else 0
+        misses = self._pool.misses if self._pool else 0
+        
+        return {
+            "connections": misses,
+            "requests": hits + misses,
+            "hits": hits,
+            "misses": misses
+        }
+    
+    
+    async def close(self):
+        """Close all pooled connections"""
+        if self._pool is not None:
+            await self._pool.close()
+        self._pool = None
+    
+    
+    def __enter__(self):
+        raise TypeError("Use 'async with' with AsyncTelegramKeyboard")
+    
+    
+    async def __aenter__(self):
+        return self
+    
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return False
+    
+    
+    # ==================== SEND MESSAGE METHODS ====================
+    
+    async def send_message(self, chat_id, text, keyboard=None, parse_mode=None):
+        """
+        Send message with optional keyboard
+        
+        Args:
+            chat_id (int/str): Chat ID
+            text (str): Message text
+            keyboard (dict/FrozenKeyboard/str): Keyboard markup, frozen
+                keyboard or registered keyboard id (optional)
+            parse_mode (str): 'HTML' or 'Markdown' (optional)
+        
+        Returns:
+            dict: Response from Telegram API
+        """
+        data = self._message_payload(chat_id, text, keyboard, parse_mode)
+        result = await self._request("sendMessage", data)
+        
+        if self.message_states is not None:
+            self._remember_sent(chat_id, data, result)
+        return result
+    
+    
+    async def send_with_reply_keyboard(self, chat_id, text, buttons, **kwargs):
+        """Send message with reply keyboard"""
+        keyboard = self.create_reply_keyboard(buttons, **kwargs)
+        return await self.send_message(chat_id, text, keyboard)
+    
+    
+    async def send_with_inline_keyboard(self, chat_id, text, buttons, **kwargs):
+        """Send message with inline keyboard"""
+        keyboard = self.create_inline_keyboard(buttons)
+        return await self.send_message(chat_id, text, keyboard, **kwargs)
+    
+    
+    async def send_remove_keyboard(self, chat_id, text):
+        """Send message and remove keyboard"""
+        keyboard = self.remove_keyboard()
+        return await self.send_message(chat_id, text, keyboard)
+    
+    
+    def broadcast(self, chat_ids, text, keyboard=None, parse_mode=None,
+                  **options):
+        """
+        Send the same message to many chats within rate limits
+        
+        Returns:
+            async generator: BroadcastResult per chat as sends complete
+        """
+        broadcaster = Broadcaster(self, **options)
+        return broadcaster.run_async(chat_ids, text, keyboard, parse_mode)
+    
+    
+    # ==================== CALLBACK QUERY ====================
+    
+    async def answer_callback_query(self, callback_query_id, text=None,
+                                    show_alert=False, url=None):
+        """
+        Answer callback query (inline button click)
+        
+        Args:
+            callback_query_id (str): Callback query ID
+            text (str): Notification text
+            show_alert (bool): Show as alert or toast
+            url (str): URL to open
+        
+        Returns:
+            dict: API response
+        """
+        data = self._callback_answer_payload(callback_query_id, text,
+                                             show_alert, url)
+        return await self._request("answerCallbackQuery", data,
+                                   throttled=False)
+    
+    
+    async def edit_message_text(self, chat_id, message_id, text, keyboard=None,
+                                force=False, inline_message_id=None):
+        """
+        Edit message text (for inline keyboards)
+        
+        An edit identical to the content last sent to this message is
+        answered locally with {"ok": True, "result": None,
+        "not_modified": True} instead of calling Telegram.
+        
+        Args:
+            chat_id: Chat ID
+            message_id: Message ID to edit
+            text: New text
+            keyboard: New keyboard (optional)
+            force (bool): Send even if the content looks unchanged
+            inline_message_id (str): Edit an inline-mode message instead
+                (chat_id and message_id are then ignored)
+        
+        Returns:
+            dict: API response
+        """
+        data = self._edit_payload(chat_id, message_id, text, keyboard,
+                                  inline_message_id)
+        
+        if self.message_states is None:
+            return await self._request("editMessageText", data,
+                                       throttled=False)
+        
+        key = _state_key(chat_id, message_id, inline_message_id)
+        state = _message_state(data)
+        if not force and self._is_noop_edit(key, state):
+            return _not_modified_response()
+        
+        result = await self._request("editMessageText", data,
+                                     throttled=False)
+        self._remember_state(key, state, result)
+        return result
+    
+    
+    async def edit_message_reply_markup(self, chat_id=None, message_id=None,
+                                        keyboard=None, inline_message_id=None,
+                                        force=False):
+        """
+        Replace only the inline keyboard of a message
+        
+        The text is not resent, so toggling a button or turning a page
+        under a long message costs just the markup.
+        
+        Args:
+            chat_id: Chat ID
+            message_id: Message ID to edit
+            keyboard: New inline keyboard (None removes it)
+            inline_message_id (str): Edit an inline-mode message instead
+            force (bool): Send even if the keyboard looks unchanged
+        
+        Returns:
+            dict: API response
+        """
+        return await self.edit_message(chat_id, message_id, None, keyboard,
+                                 inline_message_id=inline_message_id,
+                                 force=force)
+    
+    
+    async def edit_message(self, chat_id=None, message_id=None, text=None,
+                           keyboard=None, inline_message_id=None, force=False):
+        """
+        Edit a message using the cheapest API call
+        
+        Compares the new content with what was last sent to the message:
+        nothing changed -> no request (not_modified=True); only the
+        keyboard changed -> editMessageReplyMarkup; otherwise
+        editMessageText. With text=None only the keyboard is edited.
+        
+        Args:
+            chat_id: Chat ID
+            message_id: Message ID to edit
+            text: New text (None keeps the current text)
+            keyboard: New inline keyboard (optional)
+            inline_message_id (str): Edit an inline-mode message instead
+            force (bool): Skip the no-op check and resend the text
+        
+        Returns:
+            dict: API response
+        """
+        method, data, key, state = self._plan_edit(
+            chat_id, message_id, text, keyboard, inline_message_id, force
+        )
+        if method is None:
+            return _not_modified_response()
+        
+        result = await self._request(method, data, throttled=False)
+        if state is not None:
+            self._remember_state(key, state, result)
+        return result
+    
+    
+    # ==================== UPDATES ====================
+    
+    async def get_updates(self, offset=None, limit=100, timeout=30,
+                          allowed_updates=None):
+        """Long-poll for incoming updates (see TelegramKeyboard.get_updates)"""
+        data = self._updates_payload(offset, limit, timeout, allowed_updates)
+        return await self._request("getUpdates", data, timeout=timeout + 10,
+                                   throttled=False)
+
+
+# ==================== BROADCAST ====================
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter"""
+    
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate (float): Tokens added per second
+            capacity (float): Max burst size (defaults to rate, min 1)
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    
+    def reserve(self):
+        """
+        Take one token, going into debt if none are left
+        
+        Returns:
+            float: Seconds the caller must wait before using the token
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+    
+    
+    def acquire(self):
+        """Block until a token is available"""
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+    
+    
+    async def acquire_async(self):
+        """Wait (without blocking the loop) until a token is available"""
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+BroadcastResult = namedtuple(
+    "BroadcastResult", ["index", "chat_id", "status", "response", "error"]
+)
+
+
+class Broadcaster:
+    """
+    Send one message + keyboard to many chats within Telegram limits
+    
+    The reply_markup is serialized once, sends are paced by a per-chat
+    token bucket plus the client's global rate controller and run
+    concurrently. Results are streamed back as they complete, one
+    BroadcastResult per chat with status 'sent', 'failed' or 'blocked'.
+    """
+    
+    def __init__(self, kb, global_rate=None, per_chat_rate=1, concurrency=8,
+                 max_tracked_chats=10000):
+        """
+        Args:
+            kb (TelegramKeyboard): Client used to send messages
+            global_rate (float): Extra cap in messages per second for this
+                broadcast (the client's rate controller always applies)
+            per_chat_rate (float): Max messages per second to one chat
+            concurrency (int): Max sends in flight
+            max_tracked_chats (int): Per-chat buckets kept in memory
+        """
+        self.kb = kb
+        self.global_bucket = TokenBucket(global_rate) if global_rate else None
+        self.per_chat_rate = per_chat_rate
+        self.concurrency = concurrency
+        self.max_tracked_chats = max_tracked_chats
+        
+        self._chat_buckets = OrderedDict()
+        self._chat_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.failed_chat_ids = []
+    
+    
+    def _chat_bucket(self, chat_id):
+        """Get (or create) the bucket for a chat, evicting the oldest"""
+        with self._chat_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self.per_chat_rate, capacity=1)
+                self._chat_buckets[chat_id] = bucket
+                if len(self._chat_buckets) > self.max_tracked_chats:
+                    self._chat_buckets.popitem(last=False)
+            else:
+                self._chat_buckets.move_to_end(chat_id)
+            return bucket
+    
+    
+    def _delay(self, chat_id):
+        """Reserve per-chat (and broadcast-wide) tokens for one send"""
+        delay = self._chat_bucket(chat_id).reserve()
+        if self.global_bucket is not None:
+            delay = max(delay, self.global_bucket.reserve())
+        return delay
+    
+    
+    def _result(self, index, chat_id, response=None, error=None):
+        """Classify a send outcome and update the counters"""
+        if error is None and response.get("ok"):
+            status = "sent"
+        elif error is None and response.get("error_code") == 403:
+            status = "blocked"
+        else:
+            status = "failed"
+        
+        # run() calls this from its worker threads
+        with self._counter_lock:
+            if status == "sent":
+                self.sent += 1
+            elif status == "blocked":
+                self.blocked += 1
+            else:
+                self.failed += 1
+                self.failed_chat_ids.append(chat_id)
+        
+        return BroadcastResult(index, chat_id, status, response, error)
+    
+    
+    def _send(self, index, chat_id, payload):
+        """Send to one chat once both buckets allow it"""
+        delay = self._delay(chat_id)
+        if delay:
+            time.sleep(delay)
+        
+        data = dict(payload, chat_id=chat_id)
+        try:
+            response = self.kb._request("sendMessage", data)
+        except Exception as e:
+            return self._result(index, chat_id, error=e)
+        return self._result(index, chat_id, response)
+    
+    
+    def run(self, chat_ids, text, keyboard=None, parse_mode=None):
+        """
+        Broadcast on a thread pool
+        
+        Args:
+            chat_ids (iterable): Chat IDs (consumed lazily)
+            text (str): Message text
+            keyboard (dict): Keyboard markup (optional)
+            parse_mode (str): 'HTML' or 'Markdown' (optional)
+        
+        Yields:
+            BroadcastResult: One per chat, in completion order
+        """
+        payload = self.kb._message_payload(None, text, keyboard, parse_mode)
+        del payload["chat_id"]
+        
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = set()
+            for index, chat_id in enumerate(chat_ids):
+                pending.add(executor.submit(self._send, index, chat_id, payload))
+                
+                if len(pending) >= self.concurrency * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            
+            for future in as_completed(pending):
+                yield future.result()
+    
+    
+    async def run_async(self, chat_ids, text, keyboard=None, parse_mode=None):
+        """
+        Broadcast with asyncio tasks (for AsyncTelegramKeyboard)
+        
+        Args:
+            chat_ids (iterable): Chat IDs (consumed lazily)
+            text (str): Message text
+            keyboard (dict): Keyboard markup (optional)
+            parse_mode (str): 'HTML' or 'Markdown' (optional)
+        
+        Yields:
+            BroadcastResult: One per chat, in completion order
+        """
+        payload = self.kb._message_payload(None, text, keyboard, parse_mode)
+        del payload["chat_id"]
+        
+        async def send(index, chat_id):
+            delay = self._delay(chat_id)
+            if delay:
+                await asyncio.sleep(delay)
+            
+            data = dict(payload, chat_id=chat_id)
+            try:
+                response = await self.kb._request("sendMessage", data)
+            except Exception as e:
+                return self._result(index, chat_id, error=e)
+            return self._result(index, chat_id, response)
+        
+        pending = set()
+        for index, chat_id in enumerate(chat_ids):
+            pending.add(asyncio.ensure_future(send(index, chat_id)))
+            
+            if len(pending) >= self.concurrency:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+    
+    
+    def report(self):
+        """
+        Totals so far
+        
+        Returns:
+            dict: sent, failed, blocked, failed_chat_ids
+        """
+        with self._counter_lock:
+            return {
+                "sent": self.sent,
+                "failed": self.failed,
+                "blocked": self.blocked,
+                "failed_chat_ids": list(self.failed_chat_ids)
+            }
+
+
+# ==================== FLOOD CONTROL ====================
+
+class RateController:
+    """
+    Adaptive send rate for one bot (AIMD)
+    
+    Every throttled request (sendMessage) takes a token from a shared
+    bucket. A 429 response
+    pauses all senders for retry_after seconds and halves the rate;
+    while responses keep succeeding the rate creeps back up to
+    max_rate one step per increase_interval.
+    """
+    
+    def __init__(self, rate=30, min_rate=1, max_rate=30, decrease_factor=0.5,
+                 increase_step=1, increase_interval=1.0):
+        """
+        Args:
+            rate (float): Starting requests per second
+            min_rate (float): Lowest rate after repeated 429s
+            max_rate (float): Highest rate the controller climbs back to
+            decrease_factor (float): Rate multiplier applied on a 429
+            increase_step (float): Rate added per quiet interval
+            increase_interval (float): Seconds between rate increases
+        """
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self.increase_interval = increase_interval
+        
+        self.bucket = TokenBucket(rate)
+        self.blocked_until = 0.0
+        self.flood_count = 0
+        
+        self._last_change = time.monotonic()
+        self._lock = threading.Lock()
+    
+    
+    @property
+    def rate(self):
+        """Current requests per second"""
+        return self.bucket.rate
+    
+    
+    def _set_rate(self, rate):
+        """Change the bucket rate and burst size together"""
+        self.bucket.rate = rate
+        self.bucket.capacity = max(rate, 1)
+    
+    
+    def acquire(self):
+        """Block until flood wait is over and a token is available"""
+        while True:
+            pause = self.blocked_until - time.monotonic()
+            if pause <= 0:
+                break
+            time.sleep(pause)
+        self.bucket.acquire()
+    
+    
+    async def acquire_async(self):
+        """Wait (without blocking the loop) for flood wait and a token"""
+        while True:
+            pause = self.blocked_until - time.monotonic()
+            if pause <= 0:
+                break
+            await asyncio.sleep(pause)
+        await self.bucket.acquire_async()
+    
+    
+    def on_flood(self, retry_after):
+        """
+        Record a 429 response
+        
+        Concurrent 429s inside one flood wait only lower the rate once.
+        
+        Args:
+            retry_after (float): Seconds Telegram asked us to wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.flood_count += 1
+            
+            if now >= self.blocked_until:
+                self._set_rate(max(self.rate * self.decrease_factor,
+                                   self.min_rate))
+            
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            self._last_change = self.blocked_until
+    
+    
+    def on_success(self):
+        """Record a non-429 response, raising the rate when due"""
+        if self.rate >= self.max_rate:
+            return
+        
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_change >= self.increase_interval:
+                self._set_rate(min(self.rate + self.increase_step,
+                                   self.max_rate))
+                self._last_change = now
+    
+    
+    def stats(self):
+        """
+        Throttle state for monitoring
+        
+        Returns:
+            dict: rate, max_rate, throttled, blocked_for, flood_count
+        """
+        blocked_for = max(self.blocked_until - time.monotonic(), 0.0)
+        
+        return {
+            "rate": self.rate,
+            "max_rate": self.max_rate,
+            "throttled": blocked_for > 0 or self.rate < self.max_rate,
+            "blocked_for": blocked_for,
+            "flood_count": self.flood_count
+        }
+
+
+def _retry_after(response):
+    """Return retry_after seconds for a 429 response, else None"""
+    if response.get("error_code") != 429:
+        return None
+    return response.get("parameters", {}).get("retry_after", 1)
+
+
+# bot_token -> RateController, kept while some client uses it
+_rate_controllers = weakref.WeakValueDictionary()
+_rate_controllers_lock = threading.Lock()
+
+
+def shared_rate_controller(bot_token):
+    """
+    Rate controller shared by every client of one bot
+    
+    Telegram's limits are per bot token, so clients that are not given
+    their own controller share one per token and a 429 on one bot
+    never slows down another.
+    
+    Args:
+        bot_token (str): Bot API token
+    
+    Returns:
+        RateController: Controller for this token
+    """
+    with _rate_controllers_lock:
+        controller = _rate_controllers.get(bot_token)
+        if controller is None:
+            controller = _rate_controllers[bot_token] = RateController()
+        return controller
+
+
+# ==================== REQUEST METRICS ====================
+
+# Latency histogram bounds in seconds (getUpdates long polls included)
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                           2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _MethodMetrics:
+    """Counters of one API method"""
+    
+    __slots__ = ("buckets", "latency_sum", "count", "request_bytes",
+                 "response_bytes", "errors")
+    
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.latency_sum = 0.0
+        self.count = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.errors = {}
+
+
+class RequestMetrics:
+    """
+    Per-method latency histograms, byte counts and error codes
+    
+    Pass one instance as metrics= to any number of clients; without
+    it the clients skip recording entirely. Read the numbers with
+    snapshot() or prometheus() (text exposition format).
+    
+    Example:
+        metrics = RequestMetrics()
+        kb = TelegramKeyboard(BOT_TOKEN, metrics=metrics)
+        ...
+        print(metrics.prometheus())
+    """
+    
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS,
+                 prefix="telegram_bot_api"):
+        """
+        Args:
+            buckets (tuple): Ascending latency bucket bounds (seconds)
+            prefix (str): Metric name prefix for prometheus()
+        """
+        self.bounds = tuple(buckets)
+        self.prefix = prefix
+        self._methods = {}
+        self._lock = threading.Lock()
+    
+    
+    def observe(self, api_method, seconds, request_bytes, response_bytes,
+                error=None):
+        """
+        Record one HTTP exchange
+        
+        Args:
+            api_method (str): Bot API method name
+            seconds (float): Request latency
+            request_bytes (int): Request body size
+            response_bytes (int): Response body size
+            error: error_code of an ok=false reply, or the exception
+                type name of a failed request (None on success)
+        """
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            stats = self._methods.get(api_method)
+            if stats is None:
+                stats = self._methods[api_method] = _MethodMetrics(len(self.bounds) + 1)
+            stats.buckets[index] += 1
+            stats.latency_sum += seconds
+            stats.count += 1
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+            if error is not None:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+    
+    
+    def _quantile(self, buckets, count, q):
+        """Quantile estimate by interpolating inside its bucket"""
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(buckets):
+            if seen + n >= rank and n:
+                lower = self.bounds[i - 1] if i else 0.0
+                if i == len(self.bounds):
+                    return lower
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+    
+    
+    def snapshot(self):
+        """
+        Current counters (pull API)
+        
+        Returns:
+            dict: api_method -> count, errors (by code), error_count,
+                request_bytes, response_bytes, latency (sum, avg, p50,
+                p95, p99 in seconds, buckets as [(le, cumulative)])
+        """
+        with self._lock:
+            methods = {
+                name: (list(m.buckets), m.latency_sum, m.count,
+                       m.request_bytes, m.response_bytes, dict(m.errors))
+                for name, m in self._methods.items()
+            }
+        
+        snapshot = {}
+        for name, (buckets, total, count, sent, received, errors) in methods.items():
+            cumulative = []
+            running = 0
+            for bound, n in zip(self.bounds + (float("inf"),), buckets):
+                running += n
+                cumulative.append((bound, running))
+            
+            snapshot[name] = {
+                "count": count,
+                "errors": errors,
+                "error_count": sum(errors.values()),
+                "request_bytes": sent,
+                "response_bytes": received,
+                "latency": {
+                    "sum": total,
+                    "avg": total / count if count else 0.0,
+                    "p50": self._quantile(buckets, count, 0.50),
+                    "p95": self._quantile(buckets, count, 0.95),
+                    "p99": self._quantile(buckets, count, 0.99),
+                    "buckets": cumulative
+                }
+            }
+        return snapshot
+    
+    
+    def prometheus(self):
+        """
+        Prometheus text exposition of all counters
+        
+        Returns:
+            str: Metrics in text format 0.0.4
+        """
+        p = self.prefix
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {p}_request_duration_seconds Bot API request latency",
+            f"# TYPE {p}_request_duration_seconds histogram"
+        ]
+        for name, m in sorted(snapshot.items()):
+            for bound, count in m["latency"]["buckets"]:
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{p}_request_duration_seconds_bucket{{method="{name}",le="{le}"}} {count}')
+            lines.append(f'{p}_request_duration_seconds_sum{{method="{name}"}} {m["latency"]["sum"]!r}')
+            lines.append(f'{p}_request_duration_seconds_count{{method="{name}"}} {m["count"]}')
+        
+        for metric, key, help_text in (
+            ("request_bytes_total", "request_bytes", "Request body bytes sent"),
+            ("response_bytes_total", "response_bytes", "Response body bytes received")
+        ):
+            lines.append(f"# HELP {p}_{metric} {help_text}")
+            lines.append(f"# TYPE {p}_{metric} counter")
+            for name, m in sorted(snapshot.items()):
+                lines.append(f'{p}_{metric}{{method="{name}"}} {m[key]}')
+        
+        lines.append(f"# HELP {p}_errors_total Failed requests by error code")
+        lines.append(f"# TYPE {p}_errors_total counter")
+        for name, m in sorted(snapshot.items()):
+            for code, count in sorted(m["errors"].items(), key=lambda item: str(item[0])):
+                lines.append(f'{p}_errors_total{{method="{name}",code="{code}"}} {count}')
+        
+        return "\n".join(lines) + "\n"
+    
+    
+    def reset(self):
+        """Clear all counters"""
+        with self._lock:
+            self._methods.clear()
+
+
+# ==================== REQUEST HOOKS ====================
+
+class RequestEvent:
+    """
+    One HTTP attempt of a Bot API call, as seen by request hooks
+    
+    before hooks see the request fields; duration, response_bytes,
+    result, error and exception are filled in before after/error
+    hooks run. context is free for hooks to store state (e.g. spans).
+    """
+    
+    __slots__ = ("api_method", "chat_id", "request_bytes", "attempt",
+                 "duration", "response_bytes", "result", "error",
+                 "exception", "context")
+    
+    def __init__(self, api_method, chat_id, request_bytes, attempt):
+        self.api_method = api_method
+        self.chat_id = chat_id
+        self.request_bytes = request_bytes
+        self.attempt = attempt
+        self.duration = None
+        self.response_bytes = 0
+        self.result = None
+        self.error = None
+        self.exception = None
+        self.context = {}
+    
+    
+    def __repr__(self):
+        return (f"RequestEvent({self.api_method}, chat_id={self.chat_id!r}, "
+                f"request_bytes={self.request_bytes}, duration={self.duration}, "
+                f"error={self.error!r})")
+
+
+class RequestHook:
+    """
+    before / after / error callbacks around client requests
+    
+    Each callback gets the RequestEvent of one HTTP attempt; after runs
+    for ok responses, error for ok=false replies and exceptions. With
+    sample_rate < 1 only that fraction of requests reaches the hook
+    (the same requests for all three callbacks).
+    """
+    
+    __slots__ = ("before", "after", "error", "sample_rate")
+    
+    def __init__(self, before=None, after=None, error=None, sample_rate=1.0):
+        """
+        Args:
+            before (callable): before(event), right before sending
+            after (callable): after(event), after an ok response
+            error (callable): error(event), after a failed request
+            sample_rate (float): Fraction of requests hooked (0-1)
+        """
+        self.before = before
+        self.after = after
+        self.error = error
+        self.sample_rate = sample_rate
+    
+    
+    def sampled(self):
+        """Whether the next request is hooked"""
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+
+def _call_hook(callback, event):
+    """Run a hook callback; its failures never affect the request"""
+    if callback is None:
+        return
+    try:
+        callback(event)
+    except Exception:
+        logger.exception("Request hook %r failed", callback)
+
+
+# ==================== MESSAGE STATE CACHE ====================
+
+class MessageStateCache:
+    """
+    Bounded LRU (with TTL) of the last content sent per message
+    
+    Values are (text digest, reply_markup digest) pairs, so memory use
+    does not depend on message size.
+    """
+    
+    def __init__(self, maxsize=10000, ttl=3600):
+        """
+        Args:
+            maxsize (int): Max tracked messages
+            ttl (float): Seconds an entry stays valid
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    
+    def get(self, key):
+        """Stored state for key, or None if absent/expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, state = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return state
+    
+    
+    def put(self, key, state):
+        """Store the state last sent for key"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, state)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    
+    def discard(self, key):
+        """Forget a message (e.g. after it was deleted)"""
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    
+    def record(self, skipped):
+        """
+        Count one edit decision (edits run on many threads at once)
+        
+        Args:
+            skipped (bool): The edit was a no-op and not sent
+        """
+        with self._lock:
+            if skipped:
+                self.hits += 1
+            else:
+                self.misses += 1
+    
+    
+    def stats(self):
+        """
+        Cache counters (a hit is an edit skipped as a no-op)
+        
+        Returns:
+            dict: hits, misses, hit_ratio, size, maxsize
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize
+            }
+
+
+def _digest(value):
+    """Short fixed-size digest of a text or serialized markup"""
+    return hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+
+
+def _message_state(data):
+    """(text digest, markup digest) of a send/edit payload"""
+    return (_digest(data.get("text", "")), _digest(data.get("reply_markup", "")))
+
+
+def _state_key(chat_id, message_id, inline_message_id=None):
+    """Cache key of a chat message or an inline-mode message"""
+    if inline_message_id is not None:
+        return ("inline", inline_message_id)
+    return (str(chat_id), str(message_id))
+
+
+def _not_modified_response():
+    """Local response for an edit skipped because nothing changed"""
+    return {"ok": True, "result": None, "not_modified": True}
+
+
+# ==================== COMPACT BUTTONS ====================
+
+def _freeze_field(value):
+    """Make a button field value hashable"""
+    if isinstance(value, Mapping):
+        return tuple((k, _freeze_field(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return ("__list__",) + tuple(_freeze_field(v) for v in value)
+    return value
+
+
+def _thaw_field(value):
+    """Inverse of _freeze_field"""
+    if isinstance(value, tuple):
+        if value[:1] == ("__list__",):
+            return [_thaw_field(v) for v in value[1:]]
+        return {k: _thaw_field(v) for k, v in value}
+    return value
+
+
+class Button(Mapping):
+    """
+    Immutable, hashable inline/reply button shared across keyboards
+    
+    Create buttons with Button.from_dict() (or TelegramKeyboard with
+    compact_buttons=True): identical buttons are interned, so every
+    keyboard holding one points at the same object. Reads like a
+    dict and serializes to the Telegram button shape.
+    """
+    
+    __slots__ = ("text", "fields", "_hash", "__weakref__")
+    
+    _pool = weakref.WeakValueDictionary()
+    _pool_lock = threading.Lock()
+    
+    def __init__(self, text, fields=()):
+        """
+        Args:
+            text (str): Button text
+            fields (tuple): (key, frozen value) pairs besides text
+        """
+        self.text = text
+        self.fields = fields
+        self._hash = hash((text, fields))
+    
+    
+    @classmethod
+    def intern(cls, text, fields=()):
+        """
+        Get the shared Button for text + fields
+        
+        Args:
+            text (str): Button text
+            fields (tuple): (key, frozen value) pairs besides text
+        
+        Returns:
+            Button: Interned button
+        """
+        key = (text, fields)
+        button = cls._pool.get(key)
+        if button is None:
+            with cls._pool_lock:
+                button = cls._pool.get(key)
+                if button is None:
+                    button = cls(sys.intern(text), fields)
+                    cls._pool[key] = button
+        return button
+    
+    
+    @classmethod
+    def from_dict(cls, button):
+        """
+        Intern a button dict as returned by the create_*_button methods
+        
+        Args:
+            button (dict): Telegram button
+        
+        Returns:
+            Button: Interned button
+        """
+        if isinstance(button, Button):
+            return button
+        fields = tuple(
+            (key, _freeze_field(value))
+            for key, value in button.items() if key != "text"
+        )
+        return cls.intern(button["text"], fields)
+    
+    
+    def to_dict(self):
+        """
+        Telegram JSON shape of the button
+        
+        Returns:
+            dict: Button dict
+        """
+        button = {"text": self.text}
+        for key, value in self.fields:
+            button[key] = _thaw_field(value)
+        return button
+    
+    
+    def __getitem__(self, key):
+        if key == "text":
+            return self.text
+        for name, value in self.fields:
+            if name == key:
+                return _thaw_field(value)
+        raise KeyError(key)
+    
+    
+    def __iter__(self):
+        yield "text"
+        for name, _ in self.fields:
+            yield name
+    
+    
+    def __len__(self):
+        return len(self.fields) + 1
+    
+    
+    def __hash__(self):
+        return self._hash
+    
+    
+    def __eq__(self, other):
+        if isinstance(other, Button):
+            return self.text == other.text and self.fields == other.fields
+        return Mapping.__eq__(self, other)
+    
+    
+    def __repr__(self):
+        return f"Button({self.to_dict()!r})"
+
+
+class ButtonRow(Sequence):
+    """Interned, immutable row of buttons (serializes as a JSON array)"""
+    
+    __slots__ = ("buttons", "_hash", "__weakref__")
+    
+    _pool = weakref.WeakValueDictionary()
+    _pool_lock = threading.Lock()
+    
+    def __init__(self, buttons):
+        """
+        Args:
+            buttons (tuple): Interned Buttons and/or plain texts
+        """
+        self.buttons = buttons
+        self._hash = hash(buttons)
+    
+    
+    @classmethod
+    def intern(cls, buttons):
+        """
+        Get the shared row for a sequence of buttons
+        
+        Args:
+            buttons (list): Button dicts, Buttons or plain texts
+        
+        Returns:
+            ButtonRow: Interned row
+        """
+        key = tuple(
+            sys.intern(btn) if isinstance(btn, str) else Button.from_dict(btn)
+            for btn in buttons
+        )
+        row = cls._pool.get(key)
+        if row is None:
+            with cls._pool_lock:
+                row = cls._pool.get(key)
+                if row is None:
+                    row = cls(key)
+                    cls._pool[key] = row
+        return row
+    
+    
+    def __getitem__(self, index):
+        return self.buttons[index]
+    
+    
+    def __len__(self):
+        return len(self.buttons)
+    
+    
+    def __hash__(self):
+        return self._hash
+    
+    
+    def __eq__(self, other):
+        if isinstance(other, ButtonRow):
+            return self.buttons == other.buttons
+        return list(self.buttons) == other
+    
+    
+    def __repr__(self):
+        return f"ButtonRow({list(self.buttons)!r})"
+
+
+def compact_layout(buttons):
+    """
+    Intern a 2D button layout
+    
+    Args:
+        buttons (list): 2D list of buttons (dicts, Buttons or texts)
+    
+    Returns:
+        tuple: Tuple of shared ButtonRow objects
+    """
+    return tuple(ButtonRow.intern(row) for row in buttons)
+
+
+def compact_keyboard(keyboard):
+    """
+    Copy a keyboard markup with its button layout interned
+    
+    Args:
+        keyboard (dict): Markup from create_inline_keyboard or
+            create_reply_keyboard
+    
+    Returns:
+        dict: Markup whose rows and buttons are shared objects
+    """
+    compact = dict(keyboard)
+    for key in ("inline_keyboard", "keyboard"):
+        if key in compact:
+            compact[key] = compact_layout(compact[key])
+    return compact
+
+
+def button_pool_stats():
+    """
+    Live interned objects
+    
+    Returns:
+        dict: buttons, rows
+    """
+    return {
+        "buttons": len(Button._pool),
+        "rows": len(ButtonRow._pool)
+    }
+
+
+def _json_default(value):
+    """json.dumps hook for compact buttons and frozen mappings"""
+    if isinstance(value, Button):
+        return value.to_dict()
+    if isinstance(value, ButtonRow):
+        return list(value.buttons)
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# ==================== JSON BACKEND ====================
+
+# Canonical encoding of markup: compact separators, non-ASCII escaped
+# as \uXXXX (json.dumps with ensure_ascii). Faster backends are only
+# used if they reproduce it byte for byte.
+_JSON_SEPARATORS = (",", ":")
+
+_JSON_PROBE = {
+    "inline_keyboard": [[
+        {"text": "Café \U0001f600 ❤️  ", "callback_data": "a/b"},
+        {"text": "\"q\" \\ <&> \n\t\x00\x1f\x7f", "url": "https://t.me/x?a=1&b=2"}
+    ]],
+    "resize_keyboard": True,
+    "one_time_keyboard": False,
+    "placeholder": None,
+    "row_width": [0, -1, 2 ** 40]
+}
+
+
+def _ascii_json(text):
+    """Escape non-ASCII text (and DEL) in a JSON document like json.dumps"""
+    if text.isascii() and "\x7f" not in text:
+        return text
+    # Escape the whole document in C, then undo the escaping of the
+    # quotes and backslashes that were already JSON syntax
+    escaped = encode_basestring_ascii(text)[1:-1]
+    return escaped.replace('\\"', '"').replace("\\\\", "\\")
+
+
+def _stdlib_dumps(value):
+    return json.dumps(value, separators=_JSON_SEPARATORS,
+                      default=_json_default)
+
+
+def _load_orjson():
+    import orjson
+    
+    def dumps(value):
+        try:
+            text = orjson.dumps(value, default=_json_default).decode("utf-8")
+        except TypeError:
+            # Non-str keys, ints beyond 64 bits, ...
+            return _stdlib_dumps(value)
+        return _ascii_json(text)
+    
+    return dumps, orjson.loads
+
+
+def _load_ujson():
+    import ujson
+    
+    def dumps(value):
+        return _ascii_json(ujson.dumps(value, ensure_ascii=True,
+                                       escape_forward_slashes=False,
+                                       default=_json_default))
+    
+    return dumps, ujson.loads
+
+
+def _load_stdlib():
+    return _stdlib_dumps, json.loads
+
+
+_JSON_BACKENDS = OrderedDict([
+    ("orjson", _load_orjson),
+    ("ujson", _load_ujson),
+    ("json", _load_stdlib)
+])
+
+# Automatic selection order per direction. orjson parses fastest, but
+# its output has to be re-escaped to ASCII, which costs most of its
+# lead on emoji markup, so ujson encodes
+_DUMPS_ORDER = ("ujson", "orjson", "json")
+_LOADS_ORDER = ("orjson", "ujson", "json")
+
+_json_backend = None
+_json_dumps = _stdlib_dumps
+_json_loads = json.loads
+
+
+def _probe_json_backend(name):
+    """
+    Load a backend and check it against the stdlib encoding
+    
+    Returns:
+        tuple: (dumps, loads), each None if missing or not identical
+    """
+    if name not in _JSON_BACKENDS:
+        raise ValueError(f"Unknown JSON backend: {name}")
+    
+    expected = _stdlib_dumps(_JSON_PROBE)
+    try:
+        dumps, loads = _JSON_BACKENDS[name]()
+    except Exception:
+        return None, None
+    
+    try:
+        if dumps(_JSON_PROBE) != expected:
+            dumps = None
+    except Exception:
+        dumps = None
+    try:
+        if loads(expected.encode("utf-8")) != _JSON_PROBE:
+            loads = None
+    except Exception:
+        loads = None
+    return dumps, loads
+
+
+def set_json_backend(name=None):
+    """
+    Select the JSON encoder/decoder for markup, requests and responses
+    
+    Args:
+        name (str): 'orjson', 'ujson' or 'json', or 'dumps/loads' to
+            pick one per direction (e.g. 'ujson/orjson'); None picks
+            the fastest usable one for each direction
+    
+    Returns:
+        str: Name of the active backend ('dumps/loads' if they differ)
+    
+    Raises:
+        ValueError: Unknown backend, not installed, or its output
+            differs from the stdlib encoding
+    """
+    global _json_backend, _json_dumps, _json_loads
+    
+    if name:
+        dumps_name, _, loads_name = name.partition("/")
+        loads_name = loads_name or dumps_name
+        dumps = _probe_json_backend(dumps_name)[0]
+        loads = _probe_json_backend(loads_name)[1]
+        if dumps is None:
+            raise ValueError(f"JSON backend {dumps_name} is not usable")
+        if loads is None:
+            raise ValueError(f"JSON backend {loads_name} is not usable")
+    else:
+        probed = {}
+        for dumps_name in _DUMPS_ORDER:
+            probed[dumps_name] = _probe_json_backend(dumps_name)
+            dumps = probed[dumps_name][0]
+            if dumps is not None:
+                break
+        for loads_name in _LOADS_ORDER:
+            if loads_name not in probed:
+                probed[loads_name] = _probe_json_backend(loads_name)
+            loads = probed[loads_name][1]
+            if loads is not None:
+                break
+    
+    _json_dumps, _json_loads = dumps, loads
+    if dumps_name == loads_name:
+        _json_backend = dumps_name
+    else:
+        _json_backend = f"{dumps_name}/{loads_name}"
+    return _json_backend
+
+
+def get_json_backend():
+    """
+    Returns:
+        str: Name of the active JSON backend
+    """
+    return _json_backend
+
+
+# Parameters whose string values are already JSON documents
+_RAW_JSON_FIELDS = frozenset(("reply_markup", "allowed_updates"))
+
+
+def _json_body(data):
+    """
+    Encode request parameters as a JSON object
+    
+    Pre-serialized fields (reply_markup) are spliced in as nested
+    values instead of being encoded again as JSON strings.
+    
+    Args:
+        data (dict): Request parameters (None values are dropped)
+    
+    Returns:
+        bytes: application/json request body
+    """
+    plain = {}
+    raw = []
+    for key, value in data.items():
+        if value is None:
+            continue
+        if key in _RAW_JSON_FIELDS and isinstance(value, str):
+            raw.append(f'"{key}":{value}')
+        else:
+            plain[key] = value
+    
+    body = _json_dumps(plain)
+    if raw:
+        body = body[:-1] + ("," if plain else "") + ",".join(raw) + "}"
+    return body.encode("utf-8")
+
+
+# $TELEGRAM_KEYBOARD_JSON pins a backend; otherwise the fastest wins
+try:
+    set_json_backend(os.environ.get("TELEGRAM_KEYBOARD_JSON"))
+except ValueError as e:
+    logger.warning("%s, selecting automatically", e)
+    set_json_backend()
+
+
+# ==================== LAZY RESPONSES ====================
+
+class LazyResponse(Mapping):
+    """
+    Successful API response whose JSON body is parsed on first access
+    
+    Returned by clients created with lazy_responses=True for bodies
+    starting with {"ok":true, so response["ok"] is known without
+    parsing; anything else parses the body once.
+    """
+    
+    __slots__ = ("raw", "_data")
+    
+    def __init__(self, raw):
+        """
+        Args:
+            raw (bytes): Response body
+        """
+        self.raw = raw
+        self._data = None
+    
+    
+    @property
+    def parsed(self):
+        """Whether the body has been parsed yet"""
+        return self._data is not None
+    
+    
+    @property
+    def data(self):
+        """Parsed response dict"""
+        if self._data is None:
+            self._data = _json_loads(self.raw)
+        return self._data
+    
+    
+    def __getitem__(self, key):
+        if key == "ok" and self._data is None:
+            return True
+        return self.data[key]
+    
+    
+    def __iter__(self):
+        return iter(self.data)
+    
+    
+    def __len__(self):
+        return len(self.data)
+    
+    
+    def __repr__(self):
+        if self._data is None:
+            return f"LazyResponse(<{len(self.raw)} bytes>)"
+        return f"LazyResponse({self._data!r})"
+
+
+_OK_BODY = re.compile(rb'\{\s*"ok"\s*:\s*true\b')
+
+
+def _is_ok_body(raw):
+    """Whether a response body is a success, without parsing it"""
+    return _OK_BODY.match(raw) is not None
+
+
+# ==================== FROZEN KEYBOARDS ====================
+
+def _deep_freeze(value):
+    """Recursively turn dicts into read-only proxies and lists into tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _deep_freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_deep_freeze(v) for v in value)
+    return value
+
+
+class FrozenKeyboard(Mapping):
+    """
+    Immutable keyboard markup with its JSON serialized once
+    
+    Behaves like a read-only dict and can be passed anywhere a
+    keyboard is accepted; the cached JSON is sent as-is.
+    """
+    
+    __slots__ = ("_markup", "json", "name")
+    
+    def __init__(self, keyboard, name=None):
+        """
+        Args:
+            keyboard (dict): Keyboard markup from any create_* builder
+            name (str): Registry name (optional)
+        """
+        self.json = _json_dumps(keyboard)
+        # Read access is served from the serialized copy, so later
+        # edits to the source dict cannot desync the cache
+        self._markup = None
+        self.name = name
+    
+    
+    @classmethod
+    def from_json(cls, markup_json, name=None):
+        """
+        Wrap already serialized markup without re-encoding it
+        
+        Args:
+            markup_json (str): reply_markup JSON
+            name (str): Registry name (optional)
+        
+        Returns:
+            FrozenKeyboard: Keyboard sending markup_json as-is
+        """
+        frozen = cls.__new__(cls)
+        frozen.json = markup_json
+        frozen._markup = None
+        frozen.name = name
+        return frozen
+    
+    
+    @property
+    def markup(self):
+        """Read-only view of the markup (parsed on first access)"""
+        if self._markup is None:
+            self._markup = _deep_freeze(_json_loads(self.json))
+        return self._markup
+    
+    
+    def __getitem__(self, key):
+        return self.markup[key]
+    
+    
+    def __iter__(self):
+        return iter(self.markup)
+    
+    
+    def __len__(self):
+        return len(self.markup)
+    
+    
+    def __bool__(self):
+        return self.json != "{}"
+    
+    
+    def __hash__(self):
+        return hash(self.json)
+    
+    
+    def __eq__(self, other):
+        if isinstance(other, FrozenKeyboard):
+            return self.json == other.json
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        # Compare as JSON: the frozen copy holds tuples where the
+        # source keyboard has lists (and may hold Button objects)
+        try:
+            other_json = _json_dumps(other)
+        except (TypeError, ValueError):
+            return False
+        if self.json == other_json:
+            return True
+        # Same content, different key order or formatting
+        return self.markup == _deep_freeze(_json_loads(other_json))
+    
+    
+    def __repr__(self):
+        return f"FrozenKeyboard({self.json})"
+
+
+_keyboard_registry = {}
+_keyboard_registry_lock = threading.Lock()
+
+
+def register_keyboard(name, keyboard):
+    """
+    Freeze a keyboard and store it under a name
+    
+    Args:
+        name (str): Keyboard id used when sending
+        keyboard (dict): Keyboard markup
+    
+    Returns:
+        FrozenKeyboard: The registered keyboard
+    """
+    frozen = FrozenKeyboard(keyboard, name=name)
+    with _keyboard_registry_lock:
+        _keyboard_registry[name] = frozen
+    return frozen
+
+
+def get_keyboard(name):
+    """
+    Look up a registered keyboard
+    
+    Args:
+        name (str): Keyboard id
+    
+    Returns:
+        FrozenKeyboard: The registered keyboard
+    
+    Raises:
+        KeyError: If no keyboard is registered under name
+    """
+    return _keyboard_registry[name]
+
+
+def unregister_keyboard(name):
+    """
+    Remove a registered keyboard
+    
+    Args:
+        name (str): Keyboard id
+    
+    Returns:
+        FrozenKeyboard: The removed keyboard, or None
+    """
+    with _keyboard_registry_lock:
+        return _keyboard_registry.pop(name, None)
+
+
+def serialize_markup(keyboard):
+    """
+    Serialize reply_markup, reusing cached JSON where possible
+    
+    Args:
+        keyboard: Markup dict, FrozenKeyboard or registered keyboard name
+    
+    Returns:
+        str: JSON reply_markup
+    """
+    if isinstance(keyboard, FrozenKeyboard):
+        return keyboard.json
+    if isinstance(keyboard, str):
+        return get_keyboard(keyboard).json
+    return _json_dumps(keyboard)
+
+
+# ==================== KEYBOARD TEMPLATES ====================
+
+_TEMPLATE_SLOT = re.compile(r"\\u0000(\d+)\\u0000")
+
+# Same escaping json.dumps applies to strings (ASCII-only output)
+_escape_json = encode_basestring_ascii
+
+
+class KeyboardTemplate:
+    """
+    Keyboard with {placeholders}, compiled to pre-serialized JSON
+    
+    Placeholders use str.format syntax ({name} or {name:spec}, with
+    {{ and }} for literal braces) in button text and callback_data;
+    names must be plain identifiers.
+    render() substitutes JSON-escaped values into the compiled JSON,
+    so no dicts are rebuilt or re-serialized per user.
+    
+    Example:
+        counter = KeyboardTemplate(kb.create_inline_keyboard([[
+            kb.create_callback_button("Count: {count}", "count_{count}")
+        ]]))
+        kb.edit_message_text(chat_id, message_id, "Counter",
+                             counter.render(count=5))
+    """
+    
+    def __init__(self, keyboard):
+        """
+        Args:
+            keyboard (dict): Keyboard markup containing placeholders
+        """
+        self.fields = []
+        
+        plain = json.loads(_stdlib_dumps(keyboard))
+        marked = _stdlib_dumps(self._mark(plain))
+        
+        # Compiled form: literal JSON chunks alternating with field indexes
+        self._parts = _TEMPLATE_SLOT.split(marked)
+        for i in range(1, len(self._parts), 2):
+            self._parts[i] = int(self._parts[i])
+        
+        self.names = frozenset(name for name, _ in self.fields)
+    
+    
+    def _mark(self, value):
+        """Replace placeholders in strings by numbered slot markers"""
+        if isinstance(value, dict):
+            return {k: self._mark(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._mark(v) for v in value]
+        if not isinstance(value, str) or "{" not in value and "}" not in value:
+            return value
+        
+        out = []
+        for literal, name, spec, conversion in Formatter().parse(value):
+            out.append(literal)
+            if name is None:
+                continue
+            # render() fills fields by keyword only: no {0}, {a.b},
+            # {a[0]}, !r or nested {a:{b}}
+            if not name.isidentifier() or conversion or "{" in spec:
+                raise ValueError(f"Unsupported placeholder in {value!r}")
+            self.fields.append((name, spec))
+            out.append(f"\x00{len(self.fields) - 1}\x00")
+        return "".join(out)
+    
+    
+    def render_json(self, **values):
+        """
+        Render to a reply_markup JSON string
+        
+        Args:
+            **values: Placeholder values
+        
+        Returns:
+            str: reply_markup JSON
+        
+        Raises:
+            KeyError: If a placeholder has no value
+        """
+        parts = self._parts
+        fields = self.fields
+        out = [parts[0]]
+        for i in range(1, len(parts), 2):
+            name, spec = fields[parts[i]]
+            out.append(_escape_json(format(values[name], spec))[1:-1])
+            out.append(parts[i + 1])
+        return "".join(out)
+    
+    
+    def render(self, **values):
+        """
+        Render to a ready-to-send keyboard
+        
+        Args:
+            **values: Placeholder values
+        
+        Returns:
+            FrozenKeyboard: Keyboard wrapping the rendered JSON
+        """
+        return FrozenKeyboard.from_json(self.render_json(**values))
+
+
+# ==================== CALLBACK DATA CODEC ====================
+
+# Telegram's limit for callback_data, in bytes
+CALLBACK_DATA_LIMIT = 64
+
+
+class CallbackDataExpired(ValueError):
+    """Overflow token no longer present in the callback store"""
+
+
+class MemoryCallbackStore:
+    """In-memory LRU store for callback payloads that exceed 64 bytes"""
+    
+    def __init__(self, maxsize=100000):
+        """
+        Args:
+            maxsize (int): Max stored payloads (oldest are dropped)
+        """
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+    
+    
+    def put(self, token, payload):
+        with self._lock:
+            self._items[token] = payload
+            self._items.move_to_end(token)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+    
+    
+    def get(self, token):
+        with self._lock:
+            payload = self._items.get(token)
+            if payload is not None:
+                self._items.move_to_end(token)
+            return payload
+    
+    
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskCallbackStore:
+    """dbm-backed store for callback payloads that survive restarts"""
+    
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Database file path
+        """
+        self._db = dbm.open(path, "c")
+        self._lock = threading.Lock()
+    
+    
+    def put(self, token, payload):
+        with self._lock:
+            self._db[token] = payload
+    
+    
+    def get(self, token):
+        with self._lock:
+            return self._db.get(token)
+    
+    
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _write_varint(out, value):
+    """Append an unsigned LEB128 varint"""
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(buf, pos):
+    """Read an unsigned LEB128 varint, returning (value, new position)"""
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class CallbackCodec:
+    """
+    Pack typed fields into compact callback_data
+    
+    callback_data is '<name>:<base85 payload>'. Field types:
+        'uint'   non-negative int (varint)
+        'int'    signed int (zigzag varint)
+        'bool'   True/False
+        'str'    UTF-8 string
+        'bytes'  raw bytes
+        tuple/list of choices, or an Enum class (stored as index)
+    
+    Payloads that would exceed 64 bytes are kept in `store` and the
+    button carries '<name>:.<token>' instead.
+    
+    Example:
+        page_codec = CallbackCodec("pg", [("page", "uint"),
+                                          ("sort", ("asc", "desc"))])
+        data = page_codec.encode(page=3, sort="desc")     # 'pg:...'
+        page_codec.decode(data)   # {'page': 3, 'sort': 'desc'}
+        
+        router.add_callback_prefix(page_codec.prefix, on_page,
+                                   parse=page_codec.parse)
+    """
+    
+    def __init__(self, name, fields, store=None):
+        """
+        Args:
+            name (str): Short tag identifying this codec in callback_data
+            fields (list): (field name, field type) pairs
+            store: Overflow store with put()/get() (default: in-memory LRU)
+        """
+        self.name = name
+        self.prefix = f"{name}:"
+        self.store = store if store is not None else MemoryCallbackStore()
+        self.names = tuple(field for field, _ in fields)
+        self._codecs = [self._field_codec(kind) for _, kind in fields]
+    
+    
+    @staticmethod
+    def _field_codec(kind):
+        """Return (encode, decode) functions for a field type"""
+        if isinstance(kind, type) and issubclass(kind, Enum):
+            kind = tuple(kind)
+        
+        if isinstance(kind, (tuple, list)):
+            choices = tuple(kind)
+            index = {choice: i for i, choice in enumerate(choices)}
+            
+            def encode(out, value):
+                _write_varint(out, index[value])
+            
+            def decode(buf, pos):
+                i, pos = _read_varint(buf, pos)
+                return choices[i], pos
+        
+        elif kind == "uint":
+            def encode(out, value):
+                if value < 0:
+                    raise ValueError("uint field cannot be negative")
+                _write_varint(out, value)
+            
+            decode = _read_varint
+        
+        elif kind == "int":
+            def encode(out, value):
+                _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+            
+            def decode(buf, pos):
+                value, pos = _read_varint(buf, pos)
+                return (value >> 1) ^ -(value & 1), pos
+        
+        elif kind == "bool":
+            def encode(out, value):
+                out.append(1 if value else 0)
+            
+            def decode(buf, pos):
+                return buf[pos] == 1, pos + 1
+        
+        elif kind in ("str", "bytes"):
+            is_str = kind == "str"
+            
+            def encode(out, value):
+                raw = value.encode("utf-8") if is_str else bytes(value)
+                _write_varint(out, len(raw))
+                out += raw
+            
+            def decode(buf, pos):
+                size, pos = _read_varint(buf, pos)
+                raw = bytes(buf[pos:pos + size])
+                return (raw.decode("utf-8") if is_str else raw), pos + size
+        
+        else:
+            raise ValueError(f"Unknown callback field type: {kind!r}")
+        
+        return encode, decode
+    
+    
+    def encode(self, *args, **kwargs):
+        """
+        Encode field values (positionally or by name) to callback_data
+        
+        Returns:
+            str: callback_data of at most 64 bytes
+        """
+        values = dict(zip(self.names, args), **kwargs)
+        out = bytearray()
+        for name, (encode, _) in zip(self.names, self._codecs):
+            encode(out, values[name])
+        
+        data = self.prefix + base64.b85encode(bytes(out)).decode("ascii")
+        if len(data.encode("utf-8")) <= CALLBACK_DATA_LIMIT:
+            return data
+        
+        payload = bytes(out)
+        token = base64.b85encode(
+            hashlib.blake2b(payload, digest_size=10).digest()
+        ).decode("ascii")
+        self.store.put(token, payload)
+        return f"{self.prefix}.{token}"
+    
+    
+    def parse(self, value):
+        """
+        Decode the part of callback_data after the prefix
+        
+        Args:
+            value (str): Text after '<name>:'
+        
+        Returns:
+            dict: Field values
+        
+        Raises:
+            CallbackDataExpired: Overflow token not found in the store
+            ValueError: Malformed payload
+        """
+        if value.startswith("."):
+            payload = self.store.get(value[1:])
+            if payload is None:
+                raise CallbackDataExpired(value)
+        else:
+            payload = base64.b85decode(value)
+        
+        result = {}
+        pos = 0
+        try:
+            for name, (_, decode) in zip(self.names, self._codecs):
+                result[name], pos = decode(payload, pos)
+        except IndexError:
+            raise ValueError("Truncated callback payload") from None
+        return result
+    
+    
+    def decode(self, data):
+        """
+        Decode full callback_data produced by encode()
+        
+        Args:
+            data (str): callback_data
+        
+        Returns:
+            dict: Field values
+        """
+        if not data.startswith(self.prefix):
+            raise ValueError(f"callback_data is not for codec {self.name!r}")
+        return self.parse(data[len(self.prefix):])
+
+
+# ==================== UPDATE ROUTING ====================
+
+class RouteStats:
+    """
+    Hit count and handler latency for one route
+    
+    Thread-safe: dispatch() is typically called from several worker
+    threads (e.g. by a ShardedDispatcher).
+    """
+    
+    __slots__ = ("hits", "total_time", "max_time", "errors", "_lock")
+    
+    def __init__(self):
+        self.hits = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+    
+    
+    def record(self, elapsed, failed=False):
+        with self._lock:
+            self.hits += 1
+            self.total_time += elapsed
+            if elapsed > self.max_time:
+                self.max_time = elapsed
+            if failed:
+                self.errors += 1
+    
+    
+    def as_dict(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "errors": self.errors,
+                "avg_ms": self.total_time / self.hits * 1000 if self.hits else 0.0,
+                "max_ms": self.max_time * 1000
+            }
+
+
+class Router:
+    """
+    Dispatch updates to handlers via hash lookups
+    
+    Handlers are registered by exact message text, /command, exact
+    callback_data or callback_data prefix. Text, command and exact
+    callback lookups are single dict hits; prefix routes are indexed
+    by prefix length, so a lookup costs one dict hit per distinct
+    prefix length (longest prefix wins; a prefix whose `parse` rejects
+    the value is skipped).
+    
+    Handler signatures:
+        text(message)
+        command(message, args)          args: text after the command
+        callback(callback_query)
+        callback_prefix(callback_query, value)
+                                        value: rest of callback_data,
+                                        passed through `parse` if given
+    
+    Example:
+        router = Router()
+        
+        @router.command("start")
+        def start(message, args):
+            ...
+        
+        @router.callback_prefix("page_", parse=int)
+        def page(callback, page_number):
+            ...
+        
+        router.dispatch(update)
+    """
+    
+    def __init__(self):
+        self._texts = {}
+        self._commands = {}
+        self._callbacks = {}
+        self._prefixes = {}
+        self._prefix_lengths = ()
+        self._fallbacks = {}
+        self._stats = {}
+    
+    
+    # ==================== REGISTRATION ====================
+    
+    def _route(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = RouteStats()
+        return stats
+    
+    
+    def add_text(self, text, handler):
+        """Route messages whose text equals `text`"""
+        self._texts[text] = (handler, self._route(f"text:{text}"))
+    
+    
+    def add_command(self, command, handler):
+        """Route '/command' messages (with or without @botname and args)"""
+        command = command.lstrip("/").lower()
+        self._commands[command] = (handler, self._route(f"command:/{command}"))
+    
+    
+    def add_callback(self, data, handler):
+        """Route callback queries whose data equals `data`"""
+        self._callbacks[data] = (handler, self._route(f"callback:{data}"))
+    
+    
+    def add_callback_prefix(self, prefix, handler, parse=None):
+        """
+        Route callback queries whose data starts with `prefix`
+        
+        Args:
+            prefix (str): callback_data prefix, e.g. 'page_'
+            handler (callable): handler(callback_query, value)
+            parse (callable): Converts the rest of the data (e.g. int)
+        """
+        route = self._route(f"prefix:{prefix}")
+        self._prefixes[prefix] = (handler, route, parse)
+        self._prefix_lengths = tuple(sorted(
+            {len(p) for p in self._prefixes}, reverse=True
+        ))
+    
+    
+    def add_fallback(self, kind, handler):
+        """
+        Handle updates no route matched
+        
+        Args:
+            kind (str): 'message' or 'callback_query'
+            handler (callable): handler(message) / handler(callback_query)
+        """
+        self._fallbacks[kind] = (handler, self._route(f"fallback:{kind}"))
+    
+    
+    def text(self, text):
+        """Decorator form of add_text"""
+        def decorator(handler):
+            self.add_text(text, handler)
+            return handler
+        return decorator
+    
+    
+    def command(self, command):
+        """Decorator form of add_command"""
+        def decorator(handler):
+            self.add_command(command, handler)
+            return handler
+        return decorator
+    
+    
+    def callback(self, data):
+        """Decorator form of add_callback"""
+        def decorator(handler):
+            self.add_callback(data, handler)
+            return handler
+        return decorator
+    
+    
+    def callback_prefix(self, prefix, parse=None):
+        """Decorator form of add_callback_prefix"""
+        def decorator(handler):
+            self.add_callback_prefix(prefix, handler, parse)
+            return handler
+        return decorator
+    
+    
+    def fallback(self, kind):
+        """Decorator form of add_fallback"""
+        def decorator(handler):
+            self.add_fallback(kind, handler)
+            return handler
+        return decorator
+    
+    
+    # ==================== DISPATCH ====================
+    
+    def resolve(self, update):
+        """
+        Find the handler for an update without running it
+        
+        Args:
+            update (dict): Telegram update
+        
+        Returns:
+            tuple: (handler, RouteStats, args) or None
+        """
+        message = update.get("message") or update.get("edited_message")
+        if message is not None:
+            text = message.get("text")
+            if text is not None:
+                route = self._texts.get(text)
+                if route is not None:
+                    return route[0], route[1], (message,)
+                
+                if text.startswith("/"):
+                    head, _, args = text[1:].partition(" ")
+                    route = self._commands.get(head.split("@", 1)[0].lower())
+                    if route is not None:
+                        return route[0], route[1], (message, args.strip())
+            
+            route = self._fallbacks.get("message")
+            if route is not None:
+                return route[0], route[1], (message,)
+            return None
+        
+        callback = update.get("callback_query")
+        if callback is not None:
+            data = callback.get("data") or ""
+            route = self._callbacks.get(data)
+            if route is not None:
+                return route[0], route[1], (callback,)
+            
+            for length in self._prefix_lengths:
+                route = self._prefixes.get(data[:length])
+                if route is not None:
+                    handler, stats, parse = route
+                    value = data[length:]
+                    if parse is not None:
+                        try:
+                            value = parse(value)
+                        except (ValueError, TypeError):
+                            continue
+                    return handler, stats, (callback, value)
+            
+            route = self._fallbacks.get("callback_query")
+            if route is not None:
+                return route[0], route[1], (callback,)
+        
+        return None
+    
+    
+    def dispatch(self, update):
+        """
+        Run the handler matching an update
+        
+        Args:
+            update (dict): Telegram update
+        
+        Returns:
+            bool: True if a handler ran
+        """
+        resolved = self.resolve(update)
+        if resolved is None:
+            return False
+        
+        handler, stats, args = resolved
+        start = time.perf_counter()
+        try:
+            handler(*args)
+        except Exception:
+            stats.record(time.perf_counter() - start, failed=True)
+            raise
+        stats.record(time.perf_counter() - start)
+        return True
+    
+    
+    def stats(self):
+        """
+        Per-route counters
+        
+        Returns:
+            dict: route name -> hits, errors, avg_ms, max_ms
+        """
+        return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+
+# ==================== UPDATE INTAKE ====================
+
+class UpdateSource:
+    """
+    Bounded queue of incoming updates shared by Poller and WebhookReceiver
+    
+    Producers push updates with _push(); consumers iterate, call get()
+    or run(handler). Subclasses implement _start() and _stop().
+    """
+    
+    def __init__(self, max_queue=1000, on_error=None):
+        """
+        Args:
+            max_queue (int): Max received-but-unhandled updates
+            on_error (callable): on_error(exception) for intake and
+                handler errors (default: log them)
+        """
+        self.on_error = on_error or self._log_error
+        self.queue = queue.Queue(maxsize=max_queue)
+        
+        self.received = 0
+        self.handled = 0
+        self.handler_errors = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._counter_lock = threading.Lock()
+        
+        self._running = threading.Event()
+        self._stopping = threading.Event()
+    
+    
+    @staticmethod
+    def _log_error(error):
+        logger.exception("Update processing failed", exc_info=error)
+    
+    
+    def _push(self, update, block=True, timeout=None):
+        """
+        Queue an update for the consumer
+        
+        Raises:
+            queue.Full: If the queue stays full for `timeout` seconds
+        """
+        self.queue.put((update, time.monotonic()), block, timeout)
+        # WebhookReceiver pushes from one thread per connection
+        with self._counter_lock:
+            self.received += 1
+    
+    
+    def _start(self):
+        raise NotImplementedError
+    
+    
+    def _stop(self):
+        pass
+    
+    
+    def start(self):
+        """Start receiving updates (idempotent)"""
+        if self._running.is_set():
+            return
+        self._running.set()
+        self._stopping.clear()
+        self._start()
+    
+    
+    def stop(self):
+        """Stop receiving; already queued updates can still be consumed"""
+        self._running.clear()
+        self._stopping.set()
+        self._stop()
+    
+    
+    def get(self, block=True, timeout=None):
+        """
+        Next received update
+        
+        Returns:
+            dict: Update, or None on timeout / when stopped
+        """
+        while True:
+            try:
+                update, received_at = self.queue.get(block, timeout or 1.0)
+            except queue.Empty:
+                if timeout is not None or not self._running.is_set():
+                    return None
+                continue
+            
+            latency = time.monotonic() - received_at
+            self._latency_total += latency
+            if latency > self._latency_max:
+                self._latency_max = latency
+            return update
+    
+    
+    def __iter__(self):
+        self.start()
+        while self._running.is_set() or not self.queue.empty():
+            update = self.get()
+            if update is not None:
+                yield update
+    
+    
+    def run(self, handler):
+        """
+        Receive and handle updates until stop() is called
+        
+        Args:
+            handler (callable): handler(update), e.g. router.dispatch
+        """
+        for update in self:
+            try:
+                handler(update)
+            except Exception as e:
+                self.handler_errors += 1
+                self.on_error(e)
+            self.handled += 1
+    
+    
+    def stats(self):
+        """
+        Intake counters
+        
+        Returns:
+            dict: queue_depth, received, handled, handler_errors,
+                avg_latency_ms, max_latency_ms
+                (latency: received -> handler start)
+        """
+        depth = self.queue.qsize()
+        taken = self.received - depth
+        return {
+            "queue_depth": depth,
+            "received": self.received,
+            "handled": self.handled,
+            "handler_errors": self.handler_errors,
+            "avg_latency_ms": self._latency_total / taken * 1000 if taken else 0.0,
+            "max_latency_ms": self._latency_max * 1000
+        }
+
+
+class Poller(UpdateSource):
+    """
+    Pipelined long-poll update fetcher
+    
+    A background thread keeps one getUpdates request outstanding and
+    queues each batch as soon as it arrives, so the next long poll is
+    already waiting on the server while the previous batch is handled.
+    There are no fixed sleeps: only failed fetches back off (exponential
+    with jitter). The offset advances when a batch is queued, so updates
+    still in the queue are lost if the process dies.
+    
+    Example:
+        poller = Poller(kb, allowed_updates=["message", "callback_query"])
+        poller.run(router.dispatch)
+    """
+    
+    def __init__(self, kb, timeout=30, limit=100, allowed_updates=None,
+                 max_queue=1000, backoff_base=0.5, backoff_max=30,
+                 on_error=None):
+        """
+        Args:
+            kb (TelegramKeyboard): Client used for getUpdates
+            timeout (int): Long-poll timeout in seconds
+            limit (int): Max updates per getUpdates call
+            allowed_updates (list): Update types to receive (optional)
+            max_queue (int): Max fetched-but-unhandled updates; fetching
+                pauses while the queue is full
+            backoff_base (float): First retry delay after an error
+            backoff_max (float): Max retry delay
+            on_error (callable): on_error(exception) for fetch and
+                handler errors (default: log them)
+        """
+        super().__init__(max_queue, on_error)
+        self.kb = kb
+        self.timeout = timeout
+        self.limit = limit
+        self.allowed_updates = allowed_updates
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        
+        self.offset = None
+        self.fetch_errors = 0
+        self._fetcher = None
+    
+    
+    def _backoff(self, failures):
+        """Jittered exponential delay for the n-th consecutive failure"""
+        delay = min(self.backoff_base * (2 ** (failures - 1)), self.backoff_max)
+        return random.uniform(delay / 2, delay)
+    
+    
+    def _fetch_loop(self):
+        """Keep one long poll outstanding and queue every batch"""
+        failures = 0
+        while self._running.is_set():
+            try:
+                response = self.kb.get_updates(
+                    self.offset, self.limit, self.timeout, self.allowed_updates
+                )
+                if not response.get("ok"):
+                    raise RuntimeError(
+                        f"getUpdates failed: {response.get('description')}"
+                    )
+            except Exception as e:
+                failures += 1
+                self.fetch_errors += 1
+                self.on_error(e)
+                self._stopping.wait(self._backoff(failures))
+                continue
+            
+            if not self._running.is_set():
+                # Stopped during the long poll: leave the batch
+                # unconfirmed so Telegram redelivers it next time
+                break
+            
+            failures = 0
+            for update in response.get("result", []):
+                self.offset = update["update_id"] + 1
+                self._push(update)
+    
+    
+    def _start(self):
+        self._fetcher = threading.Thread(
+            target=self._fetch_loop, name="telegram-poller", daemon=True
+        )
+        self._fetcher.start()
+    
+    
+    def stats(self):
+        """
+        Poller counters
+        
+        Returns:
+            dict: UpdateSource.stats() plus offset and fetch_errors
+        """
+        stats = super().stats()
+        stats["offset"] = self.offset
+        stats["fetch_errors"] = self.fetch_errors
+        return stats
+
+
+def _is_update(value):
+    """Whether a decoded webhook body looks like a Telegram Update"""
+    if not isinstance(value, dict):
+        return False
+    update_id = value.get("update_id")
+    return isinstance(update_id, int) and not isinstance(update_id, bool)
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    """Accepts Telegram update POSTs for WebhookReceiver"""
+    
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        logger.debug("webhook: " + format, *args)
+    
+    
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+    
+    
+    def _reject(self, status):
+        """Reply without reading the body, then drop the connection"""
+        receiver = self.server.receiver
+        with receiver._counter_lock:
+            receiver.rejected += 1
+        # Unread body bytes would be parsed as the next request
+        self.close_connection = True
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.send_header("Connection", "close")
+        self.end_headers()
+    
+    
+    def do_POST(self):
+        receiver = self.server.receiver
+        
+        if self.path.split("?", 1)[0] != receiver.path:
+            return self._reject(404)
+        
+        if receiver.secret_token is not None:
+            # Headers are decoded as latin-1; compare bytes so non-ASCII
+            # values are rejected instead of raising TypeError
+            token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(token.encode("latin-1"),
+                                       receiver.secret_token.encode()):
+                return self._reject(403)
+        
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            return self._reject(400)
+        if length < 0:
+            return self._reject(400)
+        if length > receiver.max_body:
+            return self._reject(413)
+        
+        try:
+            update = _json_loads(self.rfile.read(length))
+        except ValueError:
+            update = None
+        # Handlers call update.get(...), so only queue update objects
+        if not _is_update(update):
+            with receiver._counter_lock:
+                receiver.rejected += 1
+            return self._reply(400)
+        
+        try:
+            receiver._push(update, timeout=receiver.put_timeout)
+        except queue.Full:
+            # Telegram redelivers on non-2xx, which is our backpressure
+            with receiver._counter_lock:
+                receiver.overloaded += 1
+            return self._reply(503)
+        
+        self._reply(200)
+
+
+class WebhookReceiver(UpdateSource):
+    """
+    Embedded HTTP server receiving updates via Telegram webhooks
+    
+    Updates land in the same queue/dispatch path as Poller. When the
+    queue stays full the server answers 503 and Telegram retries later.
+    Put it behind a TLS-terminating proxy, or pass ssl_context.
+    
+    Example:
+        receiver = WebhookReceiver(port=8080, secret_token="s3cret")
+        kb.set_webhook("https://bot.example.com/webhook",
+                       secret_token="s3cret")
+        receiver.run(router.dispatch)
+    """
+    
+    def __init__(self, host="0.0.0.0", port=8080, path="/webhook",
+                 secret_token=None, max_queue=1000, put_timeout=1.0,
+                 max_body=1024 * 1024, ssl_context=None, on_error=None):
+        """
+        Args:
+            host (str): Interface to listen on
+            port (int): Port to listen on (0 picks a free port)
+            path (str): URL path Telegram posts to
+            secret_token (str): Expected X-Telegram-Bot-Api-Secret-Token
+            max_queue (int): Max received-but-unhandled updates
+            put_timeout (float): Seconds to wait for queue space before
+                answering 503
+            max_body (int): Largest accepted request body in bytes
+            ssl_context (ssl.SSLContext): Serve HTTPS directly (optional)
+            on_error (callable): on_error(exception) for handler errors
+        """
+        super().__init__(max_queue, on_error)
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.put_timeout = put_timeout
+        self.max_body = max_body
+        self.ssl_context = ssl_context
+        
+        self.rejected = 0
+        self.overloaded = 0
+        self._server = None
+        self._thread = None
+    
+    
+    @property
+    def address(self):
+        """(host, port) actually bound, once started"""
+        return self._server.server_address if self._server else None
+    
+    
+    def _start(self):
+        server = ThreadingHTTPServer((self.host, self.port), _WebhookHandler)
+        server.daemon_threads = True
+        server.receiver = self
+        if self.ssl_context is not None:
+            server.socket = self.ssl_context.wrap_socket(
+                server.socket, server_side=True
+            )
+        
+        self._server = server
+        self._thread = threading.Thread(
+            target=server.serve_forever, name="telegram-webhook", daemon=True
+        )
+        self._thread.start()
+    
+    
+    def _stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+    
+    
+    def stats(self):
+        """
+        Receiver counters
+        
+        Returns:
+            dict: UpdateSource.stats() plus rejected and overloaded
+        """
+        stats = super().stats()
+        with self._counter_lock:
+            stats["rejected"] = self.rejected
+            stats["overloaded"] = self.overloaded
+        return stats
+
+
+# ==================== CONCURRENT DISPATCH ====================
+
+def get_chat_id(update):
+    """
+    Chat an update belongs to (the user for chat-less updates)
+    
+    Args:
+        update (dict): Telegram update
+    
+    Returns:
+        int: Chat ID, user ID, or update_id as a last resort
+    """
+    for key in ("message", "edited_message", "channel_post",
+                "edited_channel_post"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    
+    callback = update.get("callback_query")
+    if callback is not None:
+        message = callback.get("message")
+        if message is not None:
+            return message["chat"]["id"]
+        return callback["from"]["id"]
+    
+    for value in update.values():
+        if isinstance(value, dict) and "from" in value:
+            return value["from"]["id"]
+    return update.get("update_id")
+
+
+class ShardedDispatcher:
+    """
+    Run update handlers on worker threads, in order per chat
+    
+    Each update goes to the worker owning hash(chat_id) % workers, so
+    updates from one chat are handled one after another while other
+    chats proceed in parallel. Worker queues are bounded: submit()
+    blocks when a shard is full.
+    
+    Example:
+        dispatcher = ShardedDispatcher(router.dispatch, workers=8)
+        poller.run(dispatcher.submit)
+    """
+    
+    def __init__(self, handler, workers=8, shard_queue_size=100,
+                 on_error=None):
+        """
+        Args:
+            handler (callable): handler(update)
+            workers (int): Worker threads (= shards)
+            shard_queue_size (int): Max queued updates per shard
+            on_error (callable): on_error(exception) for handler errors
+                (default: log them)
+        """
+        self.handler = handler
+        self.workers = workers
+        self.on_error = on_error or UpdateSource._log_error
+        
+        self.submitted = 0
+        self.handled = 0
+        self.errors = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._handler_total = 0.0
+        self._handler_max = 0.0
+        self._stats_lock = threading.Lock()
+        
+        self._queues = [queue.Queue(maxsize=shard_queue_size)
+                        for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(q,),
+                             name=f"telegram-worker-{i}", daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    
+    def shard_for(self, update):
+        """Index of the worker that handles this update's chat"""
+        return hash(get_chat_id(update)) % self.workers
+    
+    
+    def submit(self, update):
+        """
+        Queue an update on its chat's shard (blocks while it is full)
+        
+        Args:
+            update (dict): Telegram update
+        """
+        self._queues[self.shard_for(update)].put((update, time.monotonic()))
+        self.submitted += 1
+    
+    
+    def _work(self, shard):
+        """Worker loop: handle one shard's updates in order"""
+        while True:
+            item = shard.get()
+            if item is None:
+                return
+            
+            update, queued_at = item
+            started = time.monotonic()
+            failed = False
+            try:
+                self.handler(update)
+            except Exception as e:
+                failed = True
+                self.on_error(e)
+            finished = time.monotonic()
+            
+            waited = started - queued_at
+            took = finished - started
+            with self._stats_lock:
+                self.handled += 1
+                self.errors += failed
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+                self._handler_total += took
+                self._handler_max = max(self._handler_max, took)
+    
+    
+    def close(self, wait=True):
+        """
+        Stop the workers after the queued updates are handled
+        
+        Args:
+            wait (bool): Block until all workers have finished
+        """
+        for shard in self._queues:
+            shard.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+    
+    
+    def stats(self):
+        """
+        Dispatcher counters
+        
+        Returns:
+            dict: submitted, handled, errors, queue_depths,
+                avg/max_wait_ms (queued -> started),
+                avg/max_handler_ms
+        """
+        handled = self.handled
+        return {
+            "submitted": self.submitted,
+            "handled": handled,
+            "errors": self.errors,
+            "queue_depths": [shard.qsize() for shard in self._queues],
+            "avg_wait_ms": self._wait_total / handled * 1000 if handled else 0.0,
+            "max_wait_ms": self._wait_max * 1000,
+            "avg_handler_ms": self._handler_total / handled * 1000 if handled else 0.0,
+            "max_handler_ms": self._handler_max * 1000
+        }
+
+
+# ==================== MULTI-PROCESS RUNNER ====================
+
+class HashRing:
+    """Consistent hash ring mapping keys (e.g. chat IDs) to node indexes"""
+    
+    def __init__(self, nodes, replicas=64):
+        """
+        Args:
+            nodes (int): Number of nodes
+            replicas (int): Virtual points per node
+        """
+        points = sorted(
+            (zlib.crc32(f"{node}:{i}".encode()), node)
+            for node in range(nodes) for i in range(replicas)
+        )
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+    
+    
+    def node_for(self, key):
+        """
+        Node owning a key (stable across processes and restarts)
+        
+        Args:
+            key: Any value with a stable str()
+        
+        Returns:
+            int: Node index
+        """
+        i = bisect.bisect(self._hashes, zlib.crc32(str(key).encode()))
+        return self._nodes[i % len(self._nodes)]
+
+
+def _process_worker(index, bot_token, client_options, rate, handler_factory,
+                    threads, inbox, handled, errors):
+    """Entry point of a ProcessRunner worker process"""
+    # Ctrl+C reaches the whole process group; only the parent reacts,
+    # draining its intake into the workers and sending the sentinels
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    kb = TelegramKeyboard(
+        bot_token,
+        rate_controller=RateController(rate=rate, max_rate=rate),
+        **client_options
+    )
+    handler = handler_factory(kb)
+    counter_lock = threading.Lock()
+    
+    def run_one(update):
+        failed = False
+        try:
+            handler(update)
+        except Exception as e:
+            failed = True
+            logger.exception("Worker %d handler failed", index, exc_info=e)
+        with counter_lock:
+            handled[index] += 1
+            errors[index] += failed
+    
+    dispatcher = None
+    if threads > 1:
+        dispatcher = ShardedDispatcher(run_one, workers=threads)
+    
+    try:
+        while True:
+            update = inbox.get()
+            if update is None:
+                break
+            if dispatcher is not None:
+                dispatcher.submit(update)
+            else:
+                run_one(update)
+    finally:
+        if dispatcher is not None:
+            dispatcher.close()
+        kb.close()
+
+
+class ProcessRunner:
+    """
+    Spread update handling across worker processes
+    
+    One intake (a Poller or WebhookReceiver) runs in the calling
+    process and routes each update, by consistent hash of its chat_id,
+    to one of `workers` processes. Each worker has its own
+    TelegramKeyboard (and so its own connection pool and rate
+    controller) built from bot_token and client_options, and a handler
+    from handler_factory(kb). Updates of one chat always reach the
+    same worker, in order.
+    
+    handler_factory must be picklable (a module-level function).
+    
+    Example:
+        def make_handler(kb):
+            return build_router(kb).dispatch
+        
+        runner = ProcessRunner(BOT_TOKEN, make_handler, workers=4)
+        runner.run(Poller(TelegramKeyboard(BOT_TOKEN)))
+    """
+    
+    def __init__(self, bot_token, handler_factory, workers=None,
+                 threads_per_worker=1, client_options=None,
+                 rate_per_worker=None, max_queue=1000, start_method=None):
+        """
+        Args:
+            bot_token (str): Bot token for the worker clients
+            handler_factory (callable): handler_factory(kb) -> handler(update)
+            workers (int): Worker processes (default: CPU count)
+            threads_per_worker (int): Handler threads in each worker
+                (ShardedDispatcher when > 1)
+            client_options (dict): Extra TelegramKeyboard arguments
+                (picklable values only)
+            rate_per_worker (float): Send rate of each worker's
+                controller (default: 30 / workers)
+            max_queue (int): Max queued updates per worker; intake
+                blocks while a worker's queue is full
+            start_method (str): multiprocessing start method (optional)
+        """
+        self.bot_token = bot_token
+        self.handler_factory = handler_factory
+        self.workers = workers or os.cpu_count() or 1
+        self.threads_per_worker = threads_per_worker
+        self.client_options = dict(client_options or {})
+        self.rate_per_worker = rate_per_worker or 30 / self.workers
+        self.max_queue = max_queue
+        
+        self.ring = HashRing(self.workers)
+        self.routed = [0] * self.workers
+        self.dropped = [0] * self.workers
+        
+        self._context = multiprocessing.get_context(start_method)
+        self._inboxes = []
+        self._processes = []
+        self._handled = None
+        self._errors = None
+        self._source = None
+        self._started_at = None
+        self._stop_requested = threading.Event()
+        self._stopped = threading.Event()
+        self._stop_timeout = 30
+        self._run_thread = None
+    
+    
+    def start(self):
+        """Start the worker processes"""
+        if self._processes:
+            return
+        
+        ctx = self._context
+        self._handled = ctx.Array("q", self.workers, lock=False)
+        self._errors = ctx.Array("q", self.workers, lock=False)
+        
+        for index in range(self.workers):
+            inbox = ctx.Queue(maxsize=self.max_queue)
+            process = ctx.Process(
+                target=_process_worker,
+                args=(index, self.bot_token, self.client_options,
+                      self.rate_per_worker, self.handler_factory,
+                      self.threads_per_worker, inbox,
+                      self._handled, self._errors),
+                name=f"telegram-worker-{index}",
+                daemon=True
+            )
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        
+        self._started_at = time.monotonic()
+    
+    
+    def _deliver(self, index, item, timeout=None):
+        """
+        Put an item on a worker's inbox, waiting while it is full
+        
+        Args:
+            index (int): Worker index
+            item: Update, or None (the stop sentinel)
+            timeout (float): Give up after this many seconds (None:
+                wait as long as the worker is alive)
+        
+        Returns:
+            bool: False if the worker died or the timeout passed first
+        """
+        inbox, process = self._inboxes[index], self._processes[index]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if not process.is_alive():
+                return False
+            wait = 0.5
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+            try:
+                if wait > 0:
+                    inbox.put(item, timeout=wait)
+                else:
+                    inbox.put_nowait(item)
+                return True
+            except queue.Full:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+    
+    
+    def submit(self, update, timeout=None):
+        """
+        Route an update to its chat's worker
+        
+        Blocks while the worker's queue is full. An update its worker
+        cannot take (dead, or still full after timeout) is counted in
+        dropped.
+        
+        Args:
+            update (dict): Telegram update
+            timeout (float): Max seconds to wait for queue space
+        
+        Raises:
+            RuntimeError: If the workers are not running
+        """
+        if not self._inboxes:
+            raise RuntimeError("ProcessRunner is not running")
+        index = self.ring.node_for(get_chat_id(update))
+        if self._deliver(index, update, timeout):
+            self.routed[index] += 1
+        else:
+            self.dropped[index] += 1
+    
+    
+    def run(self, source):
+        """
+        Feed updates from an intake into the workers until stopped
+        
+        Args:
+            source (UpdateSource): Poller or WebhookReceiver
+        """
+        self.start()
+        self._source = source
+        self._stop_requested.clear()
+        self._stopped.clear()
+        self._run_thread = threading.current_thread()
+        
+        # Ctrl+C requests a stop instead of raising KeyboardInterrupt,
+        # which could land between taking an update and routing it
+        in_main_thread = self._run_thread is threading.main_thread()
+        if in_main_thread:
+            previous_handler = signal.signal(
+                signal.SIGINT, lambda signum, frame: self._stop_requested.set()
+            )
+        
+        source.start()
+        try:
+            while not self._stop_requested.is_set() and (
+                    source._running.is_set() or not source.queue.empty()):
+                update = source.get(timeout=0.5)
+                if update is not None:
+                    self._route(source, update)
+        finally:
+            if in_main_thread:
+                signal.signal(signal.SIGINT, previous_handler)
+            self._shutdown(self._stop_timeout)
+            self._stopped.set()
+    
+    
+    def _route(self, source, update, timeout=None):
+        """submit() one update, counted like UpdateSource.run()"""
+        try:
+            self.submit(update, timeout)
+        except Exception as e:
+            source.handler_errors += 1
+            source.on_error(e)
+        source.handled += 1
+    
+    
+    def stop(self, timeout=30):
+        """
+        Drain gracefully: stop intake, route what it already received,
+        then let workers finish their queues
+        
+        Called while run() is active, this asks run() to exit and
+        (from another thread) waits for it to finish draining.
+        
+        Args:
+            timeout (float): Seconds allowed for draining; workers
+                still running then are terminated
+        """
+        if self._source is not None and not self._stopped.is_set():
+            self._stop_timeout = timeout
+            self._stop_requested.set()
+            if threading.current_thread() is not self._run_thread:
+                self._stopped.wait()
+            return
+        self._shutdown(timeout)
+    
+    
+    def _shutdown(self, timeout):
+        """
+        Stop intake, drain its queue into the workers, then join them
+        
+        Never blocks for much longer than timeout: updates a dead or
+        stuck worker cannot take count as dropped.
+        """
+        deadline = time.monotonic() + timeout
+        remaining = lambda: max(deadline - time.monotonic(), 0)
+        
+        source, self._source = self._source, None
+        if source is not None:
+            source.stop()
+            # Updates already received must reach a worker before the
+            # sentinels, or they are lost (the offset has moved on)
+            while True:
+                update = source.get(block=False)
+                if update is None:
+                    break
+                self._route(source, update, remaining())
+        
+        for index in range(len(self._inboxes)):
+            self._deliver(index, None, remaining())
+        for process in self._processes:
+            process.join(remaining())
+            if process.is_alive():
+                process.terminate()
+        for inbox in self._inboxes:
+            # Don't wait at exit to flush items no worker will read
+            inbox.cancel_join_thread()
+        
+        self._inboxes = []
+        self._processes = []
+    
+    
+    def stats(self):
+        """
+        Per-worker throughput
+        
+        Returns:
+            list: One dict per worker: routed, dropped, handled,
+                errors, per_second (handled since start), alive
+        """
+        if self._handled is None:
+            return []
+        
+        elapsed = max(time.monotonic() - self._started_at, 1e-9)
+        alive = [process.is_alive() for process in self._processes]
+        return [
+            {
+                "worker": index,
+                "routed": self.routed[index],
+                "dropped": self.dropped[index],
+                "handled": self._handled[index],
+                "errors": self._errors[index],
+                "per_second": self._handled[index] / elapsed,
+                "alive": index < len(alive) and alive[index]
+            }
+            for index in range(self.workers)
+        ]
+
+
+# ==================== EDIT COALESCING ====================
+
+class _EditSlot:
+    """Scheduling state of one (chat_id, message_id)"""
+    
+    __slots__ = ("pending", "in_flight", "scheduled", "last_sent")
+    
+    def __init__(self):
+        self.pending = None
+        self.in_flight = False
+        self.scheduled = False
+        self.last_sent = 0.0
+
+
+class EditScheduler:
+    """
+    Latest-wins coalescing of message edits
+    
+    At most one edit per (chat_id, message_id) is in flight, and
+    consecutive edits of a message are at least `window` seconds
+    apart. Edits submitted meanwhile replace each other: only the
+    newest is sent, and the futures of the replaced ones resolve to
+    {"ok": True, "superseded": True, "result": None}.
+    
+    Example:
+        edits = EditScheduler(kb, window=0.3)
+        future = edits.submit(chat_id, message_id, "Count: 5", keyboard)
+        future.result()   # API response, or the superseded marker
+    """
+    
+    def __init__(self, kb, window=0.3, workers=4):
+        """
+        Args:
+            kb (TelegramKeyboard): Client used to send the edits
+            window (float): Min seconds between edits of one message
+            workers (int): Max edits in flight (across all messages)
+        """
+        self.kb = kb
+        self.window = window
+        self.workers = workers
+        
+        self.submitted = 0
+        self.sent = 0
+        self.superseded = 0
+        self.failed = 0
+        
+        self._slots = {}
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._executor = None
+        self._thread = None
+    
+    
+    def _ensure_started(self):
+        """Start the scheduler thread on first use"""
+        if self._running:
+            return
+        self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._thread = threading.Thread(
+            target=self._loop, name="telegram-edits", daemon=True
+        )
+        self._thread.start()
+    
+    
+    def _schedule(self, key, slot):
+        """Queue a slot's pending edit for its earliest allowed time"""
+        due = max(time.monotonic(), slot.last_sent + self.window)
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, key))
+        slot.scheduled = True
+        self._cond.notify()
+    
+    
+    def submit(self, chat_id, message_id, text, keyboard=None):
+        """
+        Queue an edit, replacing any not-yet-sent edit of the message
+        
+        Args:
+            chat_id: Chat ID
+            message_id: Message ID to edit
+            text: New text
+            keyboard: New keyboard (optional)
+        
+        Returns:
+            concurrent.futures.Future: Resolves to the API response
+        """
+        key = (chat_id, message_id)
+        future = Future()
+        
+        with self._cond:
+            self._ensure_started()
+            self.submitted += 1
+            
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = _EditSlot()
+            
+            if slot.pending is not None:
+                self.superseded += 1
+                slot.pending[1].set_result(
+                    {"ok": True, "superseded": True, "result": None}
+                )
+            slot.pending = ((chat_id, message_id, text, keyboard), future)
+            
+            if not slot.in_flight and not slot.scheduled:
+                self._schedule(key, slot)
+        
+        return future
+    
+    
+    def _loop(self):
+        """Hand due edits to the executor"""
+        while True:
+            with self._cond:
+                while True:
+                    if self._heap:
+                        wait_for = self._heap[0][0] - time.monotonic()
+                        if wait_for <= 0 or not self._running:
+                            break
+                    elif not self._running and not self._slots:
+                        return
+                    else:
+                        wait_for = None
+                    self._cond.wait(wait_for)
+                
+                _, _, key = heapq.heappop(self._heap)
+                slot = self._slots[key]
+                slot.scheduled = False
+                args, future = slot.pending
+                slot.pending = None
+                slot.in_flight = True
+                slot.last_sent = time.monotonic()
+            
+            self._executor.submit(self._send, key, slot, args, future)
+    
+    
+    def _send(self, key, slot, args, future):
+        """Send one edit, then release the message for the next one"""
+        result = error = None
+        try:
+            result = self.kb.edit_message(*args)
+        except Exception as e:
+            error = e
+        
+        with self._cond:
+            if error is None and result.get("ok"):
+                self.sent += 1
+            else:
+                self.failed += 1
+            
+            slot.in_flight = False
+            if slot.pending is not None:
+                self._schedule(key, slot)
+            elif self._slots.get(key) is slot:
+                del self._slots[key]
+                self._cond.notify()
+        
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    
+    def close(self, wait=True):
+        """
+        Send all pending edits now and stop the scheduler
+        
+        Args:
+            wait (bool): Block until every edit has completed
+        """
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify()
+        
+        if wait:
+            # The loop exits once no message has edits pending or in flight
+            self._thread.join()
+            self._executor.shutdown(wait=True)
+    
+    
+    def stats(self):
+        """
+        Scheduler counters
+        
+        Returns:
+            dict: submitted, sent, superseded, failed, pending, in_flight
+        """
+        with self._cond:
+            slots = list(self._slots.values())
+        return {
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "superseded": self.superseded,
+            "failed": self.failed,
+            "pending": sum(1 for slot in slots if slot.pending is not None),
+            "in_flight": sum(1 for slot in slots if slot.in_flight)
+        }
+
+
+# ==================== CALLBACK ANSWERS ====================
+
+class CallbackAnswerer:
+    """
+    Answers callback queries off the handler's critical path
+    
+    answer() only queues the answer; a dedicated pool sends it without
+    waiting for the message rate limit, so handlers start as soon as
+    an update arrives. Callback queries seen through wrap() or track()
+    that are still unanswered `deadline` seconds after arrival get an
+    automatic answer (stopping the button's loading spinner). Answers
+    reaching the queue after `expiry` seconds are dropped, since
+    Telegram rejects them anyway; a 429 is retried after retry_after
+    only while the answer can still be accepted.
+    
+    Example:
+        answers = CallbackAnswerer(kb, deadline=1.0)
+        poller.run(answers.wrap(dispatcher.submit))
+        
+        # in a handler
+        answers.answer(callback["id"], "Saved")
+    """
+    
+    def __init__(self, kb, deadline=1.0, expiry=15.0, default_text=None,
+                 workers=4, history=10000):
+        """
+        Args:
+            kb (TelegramKeyboard): Client used to send the answers
+            deadline (float): Seconds before an unanswered query is
+                answered automatically
+            expiry (float): Seconds after which Telegram no longer
+                accepts an answer
+            default_text (str): Toast text of automatic answers
+            workers (int): Answers in flight at once
+            history (int): Expired query ids remembered to recognise
+                late answers
+        """
+        self.kb = kb
+        self.deadline = deadline
+        self.expiry = expiry
+        self.default_text = default_text
+        self.workers = workers
+        self.history = history
+        
+        self.tracked = 0
+        self.answered = 0
+        self.auto_answered = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.failed = 0
+        
+        # query id -> [received, answered]
+        self._queries = {}
+        self._expired = OrderedDict()
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._executor = None
+        self._thread = None
+    
+    
+    def _ensure_started(self):
+        """Start the deadline thread on first use"""
+        if self._running:
+            return
+        self._running = True
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="telegram-answers"
+        )
+        self._thread = threading.Thread(
+            target=self._loop, name="telegram-answer-deadlines", daemon=True
+        )
+        self._thread.start()
+    
+    
+    def track(self, callback_query, received=None):
+        """
+        Start the deadline clock of a callback query
+        
+        Args:
+            callback_query (dict): Callback query from an update
+            received (float): time.monotonic() of arrival (default: now)
+        """
+        query_id = callback_query["id"]
+        received = time.monotonic() if received is None else received
+        
+        with self._cond:
+            self._ensure_started()
+            if query_id in self._queries:
+                return
+            self.tracked += 1
+            self._queries[query_id] = [received, False]
+            self._seq += 1
+            heapq.heappush(self._heap, (received + self.deadline, self._seq,
+                                        query_id, False))
+            self._cond.notify()
+    
+    
+    def wrap(self, handler):
+        """
+        Wrap an update handler so callback queries are tracked on arrival
+        
+        Args:
+            handler (callable): handler(update), e.g. dispatcher.submit
+        
+        Returns:
+            callable: Handler to pass to Poller.run / WebhookReceiver
+        """
+        def tracking_handler(update):
+            callback = update.get("callback_query")
+            if callback is not None:
+                self.track(callback)
+            return handler(update)
+        
+        return tracking_handler
+    
+    
+    def answer(self, callback_query_id, text=None, show_alert=False,
+               url=None):
+        """
+        Queue an answer without waiting for it to be sent
+        
+        Args:
+            callback_query_id (str): Callback query ID
+            text (str): Notification text
+            show_alert (bool): Show as alert or toast
+            url (str): URL to open
+        
+        Returns:
+            concurrent.futures.Future: Resolves to the API response, or
+                {"ok": False, "dropped": True, ...} / {"ok": True,
+                "duplicate": True, ...} when nothing was sent
+        """
+        future = Future()
+        
+        with self._cond:
+            self._ensure_started()
+            if not self._claim(callback_query_id, future):
+                return future
+            received = self._queries.get(callback_query_id, (None,))[0]
+        
+        data = self.kb._callback_answer_payload(callback_query_id, text,
+                                                show_alert, url)
+        self._executor.submit(self._send, data, received, future, False)
+        return future
+    
+    
+    def _claim(self, query_id, future):
+        """
+        Mark a query answered; resolve future if it must not be sent
+        
+        Called with self._cond held.
+        """
+        if query_id in self._expired:
+            self.dropped += 1
+            future.set_result({"ok": False, "dropped": True, "result": None,
+                               "description": "callback query expired"})
+            return False
+        
+        state = self._queries.get(query_id)
+        if state is not None:
+            if state[1]:
+                self.duplicates += 1
+                future.set_result(
+                    {"ok": True, "duplicate": True, "result": None}
+                )
+                return False
+            state[1] = True
+        return True
+    
+    
+    def _loop(self):
+        """Auto-answer queries whose deadline passed, then expire them"""
+        while True:
+            with self._cond:
+                while True:
+                    if self._heap:
+                        wait_for = self._heap[0][0] - time.monotonic()
+                        if wait_for <= 0:
+                            break
+                    elif not self._running:
+                        return
+                    else:
+                        wait_for = None
+                    self._cond.wait(wait_for)
+                
+                _, _, query_id, expired = heapq.heappop(self._heap)
+                received, answered = self._queries[query_id]
+                
+                if expired:
+                    del self._queries[query_id]
+                    self._expired[query_id] = None
+                    while len(self._expired) > self.history:
+                        self._expired.popitem(last=False)
+                    continue
+                
+                self._seq += 1
+                heapq.heappush(self._heap, (received + self.expiry,
+                                            self._seq, query_id, True))
+                if answered:
+                    continue
+                self._queries[query_id][1] = True
+            
+            data = self.kb._callback_answer_payload(query_id,
+                                                    self.default_text)
+            self._executor.submit(self._send, data, received, Future(), True)
+    
+    
+    def _send(self, data, received, future, automatic):
+        """Send one answer unless Telegram's window already closed"""
+        if received is not None and time.monotonic() > received + self.expiry:
+            with self._cond:
+                self.dropped += 1
+            future.set_result({"ok": False, "dropped": True, "result": None,
+                               "description": "callback query expired"})
+            return
+        
+        try:
+            # A 429 is retried after retry_after, unless that is past
+            # the point where Telegram still accepts the answer
+            deadline = received + self.expiry if received is not None else None
+            result = self.kb._request("answerCallbackQuery", data,
+                                      timeout=self.expiry, throttled=False,
+                                      deadline=deadline)
+        except Exception as e:
+            with self._cond:
+                self.failed += 1
+            future.set_exception(e)
+            return
+        
+        # Counters are shared with the other pool threads
+        with self._cond:
+            if not result.get("ok"):
+                self.failed += 1
+            elif automatic:
+                self.auto_answered += 1
+            else:
+                self.answered += 1
+        future.set_result(result)
+    
+    
+    def close(self, wait=True):
+        """
+        Stop the deadline thread; queued answers are still sent
+        
+        Args:
+            wait (bool): Block until queued answers have completed
+        """
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._heap.clear()
+            self._cond.notify()
+        
+        if wait:
+            self._thread.join()
+            self._executor.shutdown(wait=True)
+    
+    
+    def stats(self):
+        """
+        Answer counters
+        
+        Returns:
+            dict: tracked, answered, auto_answered, duplicates, dropped,
+                failed, pending
+        """
+        with self._cond:
+            pending = sum(1 for _, answered in self._queries.values()
+                          if not answered)
+            return {
+                "tracked": self.tracked,
+                "answered": self.answered,
+                "auto_answered": self.auto_answered,
+                "duplicates": self.duplicates,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "pending": pending
+            }
+
+
+# ==================== BACKGROUND SENDING ====================
+
+class BackgroundSender:
+    """
+    Runs client calls on background threads (fire-and-forget)
+    
+    Any method of the wrapped client can be called on the sender; it
+    returns a concurrent.futures.Future at once instead of blocking.
+    Callers that never read the reply simply drop the future. Failed
+    calls (exceptions or {"ok": False} replies) are still counted,
+    logged and passed to on_error.
+    
+    Example:
+        sender = BackgroundSender(kb, on_error=report)
+        sender.send_message(chat_id, "Thanks for rating!")   # no wait
+        future = sender.edit_message(chat_id, message_id, "Done")
+    """
+    
+    def __init__(self, kb, workers=4, max_pending=10000, on_result=None,
+                 on_error=None):
+        """
+        Args:
+            kb (TelegramKeyboard): Client whose methods are run
+            workers (int): Calls in flight at once
+            max_pending (int): Queued calls before callers block
+            on_result (callable): on_result(method, result) per success
+            on_error (callable): on_error(method, error) per failure;
+                error is the exception or the failed API response
+        """
+        self.kb = kb
+        self.workers = workers
+        self.on_result = on_result
+        self.on_error = on_error
+        
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.errors = {}
+        
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="telegram-sender"
+        )
+    
+    
+    def __getattr__(self, name):
+        method = getattr(self.kb, name)
+        if not callable(method) or name.startswith("_"):
+            return method
+        
+        def submit(*args, **kwargs):
+            return self.submit(name, *args, **kwargs)
+        
+        submit.__name__ = name
+        submit.__doc__ = method.__doc__
+        return submit
+    
+    
+    def submit(self, method, *args, **kwargs):
+        """
+        Queue a client call
+        
+        Args:
+            method (str): Client method name (e.g. 'send_message')
+            *args, **kwargs: Arguments for the method
+        
+        Returns:
+            concurrent.futures.Future: Resolves to the API response
+        """
+        func = getattr(self.kb, method)
+        self._slots.acquire()
+        with self._lock:
+            self.submitted += 1
+        try:
+            return self._executor.submit(self._call, method, func, args,
+                                         kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+    
+    
+    def _call(self, method, func, args, kwargs):
+        """Run one call and report its outcome"""
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._failed(method, e)
+            raise
+        finally:
+            self._slots.release()
+        
+        if result.get("ok"):
+            with self._lock:
+                self.sent += 1
+            if self.on_result is not None:
+                self.on_result(method, result)
+        else:
+            self._failed(method, result)
+        return result
+    
+    
+    def _failed(self, method, error):
+        """Count, log and report a failed call"""
+        if isinstance(error, Exception):
+            code = type(error).__name__
+        else:
+            code = error.get("error_code", "unknown")
+        
+        with self._lock:
+            self.failed += 1
+            self.errors[code] = self.errors.get(code, 0) + 1
+        
+        logger.warning("Background %s failed: %s", method, error)
+        if self.on_error is not None:
+            try:
+                self.on_error(method, error)
+            except Exception:
+                logger.exception("on_error callback failed")
+    
+    
+    def close(self, wait=True):
+        """
+        Stop accepting calls
+        
+        Args:
+            wait (bool): Block until queued calls have completed
+        """
+        self._executor.shutdown(wait=wait)
+    
+    
+    def stats(self):
+        """
+        Sender counters
+        
+        Returns:
+            dict: submitted, sent, failed, pending, errors (by error
+                code or exception type)
+        """
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "sent": self.sent,
+                "failed": self.failed,
+                "pending": self.submitted - self.sent - self.failed,
+                "errors": dict(self.errors)
+            }
+
+
 # ==================== HELPER FUNCTIONS ====================
 
-def create_button_grid(items, columns=2, callback_prefix="item"):
+def create_button_grid(items, columns=2, callback_prefix="item", codec=None):
     """
     Create button grid from list of items
     
@@ -561,6 +5596,8 @@ def create_button_grid(items, columns=2, callback_prefix="item"):
         items (list): List of item names
         columns (int): Buttons per row
         callback_prefix (str): Callback data prefix
+        codec (CallbackCodec): Encode the item index with this
+            single-field codec instead of '<prefix>_<i>' (optional)
     
     Returns:
         list: Button layout for inline keyboard
@@ -570,7 +5607,8 @@ def create_button_grid(items, columns=2, callback_prefix="item"):
     row = []
     
     for i, item in enumerate(items):
-        row.append(kb.create_callback_button(item, f"{callback_prefix}_{i}"))
+        data = codec.encode(i) if codec is not None else f"{callback_prefix}_{i}"
+        row.append(kb.create_callback_button(item, data))
         
         if len(row) == columns:
             buttons.append(row)